@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+import time
+import select
+
+
+class AV_Clock(object):
+    """The source of time for an AV_Loop and everything it runs.
+
+    Devices must not read time.time() directly, but rather ask the
+    AV_Loop (i.e. av_loop.time()), which in turn asks its clock. This
+    allows the whole loop to run in simulated time (see AV_SimClock).
+
+    This base class is the real (wall-clock) time.
+    """
+
+    Simulated = False
+
+    def time(self):
+        """Return the current time, in seconds since the epoch."""
+        return time.time()
+
+    def wrap_poller(self, impl):
+        """Return the poller (e.g. epoll object) for the AV_Loop to use."""
+        return impl
+
+
+class AV_SimPoller(object):
+    """Wrap an epoll-like poller, advancing an AV_SimClock when idle.
+
+    Whenever the IOLoop waits for I/O, the wrapped poller is only asked
+    for events that are already pending. If there are none, the clock
+    is advanced by the time the IOLoop was prepared to wait (i.e. up to
+    its next timeout), instead of actually waiting.
+
+    Before advancing the clock, all registered fds are drained: Data
+    written to a pty is delivered to the other end by a kernel worker,
+    and may still be in flight when epoll reports nothing. poll() (as
+    opposed to epoll) asks each tty for its state, which flushes any
+    such pending input. Only when poll() also reports nothing is the
+    loop truly idle, and simulated time may advance. Otherwise, in-flight
+    data would be seen at some random later simulated time.
+    """
+
+    def __init__(self, impl, clock):
+        self.impl = impl
+        self.clock = clock
+        self.flusher = select.poll()  # Mirrors the registrations in impl
+
+    def fileno(self):
+        return self.impl.fileno()
+
+    def close(self):
+        self.impl.close()
+
+    def register(self, fd, events):
+        self.flusher.register(fd, events)
+        return self.impl.register(fd, events)
+
+    def modify(self, fd, events):
+        self.flusher.modify(fd, events)
+        return self.impl.modify(fd, events)
+
+    def unregister(self, fd):
+        try:
+            self.flusher.unregister(fd)
+        except KeyError:  # Registered before we took over (e.g. waker)
+            pass
+        return self.impl.unregister(fd)
+
+    def poll(self, timeout):
+        events = self.impl.poll(0)
+        if events or timeout <= 0:
+            return events
+        events = self.flusher.poll(0)
+        if events:
+            self.clock.stats["flushed"] += 1
+            return events
+        self.clock.advance(timeout)
+        return events
+
+
+class AV_SimClock(AV_Clock):
+    """Simulated time, advancing only while the AV_Loop would be idle.
+
+    Instead of sleeping until the next timeout, the AV_Loop jumps
+    straight to it. As long as all devices are driven by timeouts and by
+    I/O that is immediately available (e.g. fake devices on local ptys),
+    a long scenario runs as fast as the CPU allows, and runs the same way
+    every time.
+    """
+
+    Simulated = True
+
+    DefaultStart = 1000000000.0  # Arbitrary, but fixed, epoch time
+
+    def __init__(self, start=DefaultStart):
+        self.now = start
+        self.idle = 0.0  # Total simulated time spent waiting
+        self.stats = {"advances": 0, "flushed": 0}
+
+    def time(self):
+        return self.now
+
+    def advance(self, secs):
+        assert secs >= 0
+        self.now += secs
+        self.idle += secs
+        self.stats["advances"] += 1
+
+    def wrap_poller(self, impl):
+        return AV_SimPoller(impl, self)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+from tornado.concurrent import Future
+
+
+class AV_Completion(object):
+    """Track the progress of a submitted A/V command through its stages.
+
+    A command progresses through the following Stages:
+     - "queued": The command has been dispatched to its handler(s), and
+       any resulting writes have been added to the device write queue(s).
+     - "written": All writes resulting from the command have been written
+       to the device(s).
+     - "confirmed": The device(s) have reported that the command took
+       effect. What counts as such a report is up to each device, e.g.
+       an AVR status update showing a new volume after a VOL UP write.
+       Devices without feedback specific to each command may confirm
+       all writes on any feedback (see AV_SerialDevice.confirm_writes()).
+
+    The given future is resolved (with the name of the stage reached) once
+    the command has reached the requested stage, or failed with an
+    exception if the command could not be carried out.
+
+    Devices that queue writes on behalf of a command call add_write() for
+    each queued write, and wrote() once each write has been performed.
+    Devices that instead drive a command to completion over time (e.g.
+    by issuing writes in response to device feedback) call defer(), and
+    later resolve the command directly with reached() or fail().
+    """
+
+    Stages = ("queued", "written", "confirmed")
+
+    def __init__(self, cmd, stage="queued", future=None):
+        assert stage in self.Stages
+        self.cmd = cmd
+        self.stage = stage
+        self.future = Future() if future is None else future
+        self.writes = 0  # Number of queued, but not yet performed writes
+        self.queued_writes = False  # True iff any writes were queued
+        self.performed = 0  # Number of writes actually performed
+        self.deferred = False  # True iff a device will resolve us later
+
+    def __str__(self):
+        return "<%s '%s' until %s>" % (
+            self.__class__.__name__, self.cmd, self.stage)
+
+    def done(self):
+        return self.future.done()
+
+    def reached(self, stage, final=False):
+        """Record that the command has reached the given stage.
+
+        If final is set, the command will not progress any further (e.g.
+        because it did not cause any writes), and the future is resolved
+        even if the requested stage was not reached.
+        """
+        if self.done():
+            return
+        if final or self.Stages.index(stage) >= self.Stages.index(self.stage):
+            self.future.set_result(stage)
+
+    def fail(self, exc):
+        """Record that the command failed with the given exception."""
+        if not self.done():
+            self.future.set_exception(exc)
+
+    def add_write(self):
+        self.writes += 1
+        self.queued_writes = True
+
+    def defer(self):
+        """Record that a device will resolve this command later."""
+        self.deferred = True
+
+    def wrote(self):
+        """Record one performed write.
+
+        Return True iff this was the last outstanding write, in which
+        case the caller is responsible for later calling reached() with
+        "confirmed" (or fail()) once the device reports the outcome.
+        """
+        assert self.writes > 0
+        self.writes -= 1
+        self.performed += 1
+        if self.writes:
+            return False
+        self.reached("written")
+        return True
+
+    def skipped(self):
+        """Record one queued write that was dropped without being written.
+
+        This happens when writes are coalesced with (e.g. cancelled by)
+        later writes. Return like wrote() does. If none of this command's
+        writes were performed, it resolves at "queued", as it had no net
+        effect on the device.
+        """
+        assert self.writes > 0
+        self.writes -= 1
+        if self.writes:
+            return False
+        if self.performed:
+            self.reached("written")
+            return True
+        self.reached("queued", final=True)
+        return False
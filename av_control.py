@@ -25,6 +25,8 @@ from tornado.ioloop import IOLoop
 from hdmi_switch import HDMI_Switch
 from avr_device import AVR_Device
 from http_server import AV_HTTPServer
+from cmd_socket import AV_CommandSocket
+from cmd_repeater import AV_CommandRepeater
 from av_loop import AV_Loop
 
 
@@ -32,6 +34,8 @@ Devices = (
     ("hdmi", HDMI_Switch),
     ("avr",  AVR_Device),
     ("http", AV_HTTPServer),
+    ("sock", AV_CommandSocket),
+    ("repeat", AV_CommandRepeater),
 )
 
 AVR_Device.DefaultTTY = "/dev/ttyUSB1"
@@ -54,8 +58,10 @@ def main(args):
         except Exception as e:
             print(e)
 
-    if not mainloop.cmd_handlers:
+    if not mainloop.cmd_router:
         print("No A/V commands registered. Aborting...")
+        for dev in mainloop.devices.values():
+            dev.close()
         return 1
 
     def cmd_catch_all(empty, cmd):
@@ -16,13 +16,33 @@ class AV_Device(object):
     def debug(self, s):
         """Convenience method for debug output."""
         if self.Debug:
-            import time
-            ts = time.time() - self.av_loop.t0
+            ts = self.av_loop.get_ts()
             print("%7.2f: %s" % (ts, self), s)
 
     def __init__(self, av_loop, name):
         self.av_loop = av_loop
         self.name = name
 
+    def diagnostics(self):
+        """Return a dict of runtime statistics for this device.
+
+        Should be extended in subclasses that keep such statistics.
+        """
+        return {}
+
+    def close(self):
+        """Release resources (e.g. sockets) before the AV_Loop exits.
+
+        Should be overridden in subclasses that hold such resources.
+        """
+        pass
+
+    def discard_writes(self, completion):
+        """Drop pending writes attached to the given AV_Completion.
+
+        Must be overridden in subclasses that queue writes.
+        """
+        pass
+
     def __str__(self):
         return "<%s %s>" % (self.__class__.__name__, self.name)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+import os
+import errno
+from collections import deque
+
+from avr_dgram import AVR_Datagram
+
+
+class AV_Framer(object):
+    """Split a byte stream into fixed-length AVR datagrams.
+
+    Bytes are read straight into a preallocated buffer (see fill() and
+    fill_from_fd()), and complete datagrams are handed out by frames()
+    as memoryview slices of that buffer, so no bytes are copied on the
+    way from the tty to the datagram parser.
+
+    The buffer is not a wrap-around ring, since frames must be contiguous
+    to be handed out as single memoryviews. Instead, before each fill, the
+    (at most one partial frame of) unconsumed bytes are moved to the front
+    of the buffer.
+
+    Corrupt datagrams are skipped and counted by kind, instead of being
+    handed out (see frames()), and the last few are kept for diagnosis.
+    """
+
+    DefaultCapacity = 4096
+
+    MaxBadFrames = 16  # Number of bad frames to keep for diagnostics()
+
+    def __init__(self, dgram_spec, capacity=DefaultCapacity):
+        self.d_start = dgram_spec[0]
+        self.d_head = AVR_Datagram.expect_dgram_start(dgram_spec)
+        self.d_len = AVR_Datagram.full_dgram_len(dgram_spec)
+        assert len(self.d_head) < self.d_len <= capacity
+
+        self.buf = bytearray(capacity)
+        self.view = memoryview(self.buf)
+        self.start = 0  # Index of first unconsumed byte in self.buf
+        self.end = 0  # Index of first unused byte in self.buf
+
+        # The last datagram that passed its checksum. Identical datagrams
+        # (the AVR repeats its status continuously) need not be verified.
+        self.last_good = None
+
+        self.stats = {
+            "frames": 0,  # Good datagrams
+            "bad_start": 0,  # Runs of bytes skipped to find a datagram
+            "bad_type_len": 0,  # Datagrams with unexpected type/length
+            "bad_cksum": 0,  # Datagrams with checksum mismatch
+        }
+        self.bad_frames = deque(maxlen=self.MaxBadFrames)
+
+    def __len__(self):
+        """Return the number of buffered, unconsumed bytes."""
+        return self.end - self.start
+
+    def _compact(self):
+        if self.start:
+            pending = self.end - self.start
+            self.buf[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+
+    def fill(self, readinto):
+        """Read more bytes into the buffer with the given function.
+
+        readinto() is called with a writable memoryview of the free part
+        of the buffer, and must return the number of bytes it stored
+        there (like the readinto() method of file objects). Return that
+        number (or 0 if nothing could be read).
+
+        The memoryviews previously returned from frames() are no longer
+        valid after this call.
+        """
+        self._compact()
+        n = readinto(self.view[self.end:]) or 0
+        self.end += n
+        return n
+
+    def fill_from_fd(self, fd):
+        """Read more bytes into the buffer from the given non-blocking fd.
+
+        See fill() for more details.
+        """
+        def readinto(b):
+            try:
+                return os.readv(fd, [b])
+            except OSError as e:
+                if e.errno in (errno.EWOULDBLOCK, errno.EAGAIN):
+                    return 0
+                raise
+        return self.fill(readinto)
+
+    def record_bad(self, kind, frame):
+        """Count (and keep a copy of) a bad frame of the given kind.
+
+        Also used by consumers of frames() to report datagrams whose
+        payload could not be parsed.
+        """
+        self.stats[kind] = self.stats.get(kind, 0) + 1
+        self.bad_frames.append((kind, bytes(frame)))
+
+    def check(self, frame):
+        """Return the kind of corruption in the given datagram, if any."""
+        if frame[:len(self.d_head)] != self.d_head:
+            return "bad_type_len"
+        if frame != self.last_good:
+            data = frame[len(self.d_head):-2]
+            if frame[-2:] != AVR_Datagram.calc_cksum(data):
+                return "bad_cksum"
+            self.last_good = bytes(frame)
+        return None
+
+    def frames(self):
+        """Generate all complete, valid datagrams currently in the buffer.
+
+        Each datagram is returned as a memoryview into the buffer that
+        is only valid until the next call to fill(). Bytes preceding the
+        next start keyword (i.e. noise, or partial datagrams) are skipped
+        and counted as "bad_start". Datagrams with an unexpected type or
+        length, or a failing checksum, are counted as "bad_type_len" or
+        "bad_cksum", and we resync at the next start keyword following
+        the start of the bad datagram.
+        """
+        d_start, d_len = self.d_start, self.d_len
+        while self.end - self.start >= d_len:
+            i = self.buf.find(d_start, self.start, self.end)
+            if i < 0:  # Keep bytes that might be the start of d_start
+                keep = self.end - (len(d_start) - 1)
+                self.record_bad("bad_start", self.view[self.start:keep])
+                self.start = keep
+                return
+            if i > self.start:
+                self.record_bad("bad_start", self.view[self.start:i])
+                self.start = i
+            if self.end - i < d_len:  # Incomplete datagram
+                return
+            frame = self.view[i:i + d_len]
+            kind = self.check(frame)
+            if kind is not None:
+                self.record_bad(kind, frame)
+                j = self.buf.find(d_start, i + 1, self.end)
+                if j < 0:
+                    j = max(i + 1, self.end - (len(d_start) - 1))
+                self.start = j
+                continue
+            self.start = i + d_len
+            self.stats["frames"] += 1
+            yield frame
+
+    def diagnostics(self):
+        ret = dict(self.stats)
+        ret["bad_frames"] = [
+            {"kind": kind, "bytes": frame.hex()}
+            for kind, frame in self.bad_frames]
+        return ret
@@ -1,21 +1,37 @@
 #!/usr/bin/env python
 
-import time
 from tornado.ioloop import IOLoop
 
+from av_clock import AV_Clock
+from av_completion import AV_Completion
+from cmd_router import AV_CommandRouter
+from event_bus import AV_EventBus
+
 
 class AV_Loop(IOLoop.configurable_default()):
 
-    def initialize(self, parsed_args):
-        IOLoop.configurable_default().initialize(self)
+    SubmitTimeout = 5.0  # seconds
+
+    def initialize(self, parsed_args, clock=None):
+        # All timing goes through self.time(), i.e. the clock
+        self.clock = AV_Clock() if clock is None else clock
+        IOLoop.configurable_default().initialize(
+            self, time_func=self.clock.time)
+        self._impl = self.clock.wrap_poller(self._impl)
         self.install()
 
         self.args = parsed_args
-        self.t0 = time.time()  # Keep track of when we started
+        self.t0 = self.time()  # Keep track of when we started
 
         self.devices = {}  # Map device names to AV_Device objects
 
-        self.cmd_handlers = {}  # Map commands to list of handlers
+        self.cmd_router = AV_CommandRouter()  # Map commands to handlers
+
+        self.event_bus = AV_EventBus()  # Internal (typed) notifications
+
+        # The AV_Completion for the command currently being dispatched
+        # by submit(), if any. Devices attach their writes to it.
+        self.completion = None
 
     def add_device(self, name, dev):
         assert name not in self.devices
@@ -44,43 +60,89 @@ class AV_Loop(IOLoop.configurable_default()):
         The given handler will be invoked with two arguments, the first
         is the cmd which matched its registration, and the second is
         the remainder of the command that followed the match.
+
+        Handlers may be added or removed while commands are dispatched.
         """
-        if cmd in self.cmd_handlers:
-            self.cmd_handlers[cmd].append(handler)
-        else:
-            self.cmd_handlers[cmd] = [handler]
+        self.cmd_router.add(cmd, handler)
 
     def remove_cmd_handler(self, cmd, handler):
         """Remove the given handler for the given A/V command."""
-        try:
-            self.cmd_handlers[cmd].remove(handler)
-            if not self.cmd_handlers[cmd]:
-                del self.cmd_handlers[cmd]
-        except:
-            pass
+        self.cmd_router.remove(cmd, handler)
 
     def submit_cmd(self, cmd):
         """Forward the given A/V command to the appropriate handler(s).
 
         See the documentation of add_cmd_handler() to see how commands
         are mapped to handlers.
+
+        Returns the registered command that matched the given command
+        (i.e. the first argument passed to the handler(s)). An empty
+        string indicates that the command was passed to the catch-all
+        handler(s), and None indicates that no handler (not even a
+        catch-all) was registered for the command.
+        """
+        return self.cmd_router.dispatch(cmd)
+
+    def submit(self, cmd, stage="queued", timeout=SubmitTimeout):
+        """Submit the given A/V command, and return a Future tracking it.
+
+        The command is dispatched like submit_cmd() does. The returned
+        Future is resolved with the name of the AV_Completion stage
+        ("queued", "written" or "confirmed") once the command has reached
+        the given stage. Commands that cause no device writes are
+        resolved at "queued", unless a device defers their completion (see
+        AV_Completion.defer()). The Future fails with KeyError if there is
+        no handler for the command, with TimeoutError if the given stage
+        is not reached within the given timeout (in seconds), or with
+        whatever error the command handler(s) or device(s) report.
         """
-        pre_words = cmd.strip().split()
-        post_words = []
+        return self.dispatch(AV_Completion(cmd, stage), timeout)
 
-        def _invoke(cmd, rest):
-            for handler in self.cmd_handlers[cmd]:
-                handler(cmd, rest)
+    def dispatch(self, completion, timeout=SubmitTimeout):
+        """Submit the command of the given AV_Completion.
 
-        while pre_words:
-            pre_cmd = " ".join(pre_words)
-            if pre_cmd in self.cmd_handlers:
-                return _invoke(pre_cmd, " ".join(post_words))
-            post_words.insert(0, pre_words.pop())
-        return _invoke("", " ".join(post_words))
+        Like submit(), but for callers that need to hold on to the
+        completion itself, e.g. to later discard() its pending writes.
+        Return the completion's Future.
+        """
+        cmd, stage = completion.cmd, completion.stage
+        outer, self.completion = self.completion, completion
+        try:
+            matched = self.submit_cmd(cmd)
+        except Exception as e:
+            completion.fail(e)
+            return completion.future
+        finally:
+            self.completion = outer
+
+        if matched is None:
+            completion.fail(KeyError("No handler for '%s'" % (cmd)))
+        elif not (completion.queued_writes or completion.deferred):
+            completion.reached("queued", final=True)
+        else:
+            completion.reached("queued")
+
+        if not completion.done():
+            def expire():
+                completion.fail(TimeoutError(
+                    "'%s' did not reach %s within %gs" % (
+                        cmd, stage, timeout)))
+            handle = self.add_timeout(self.time() + timeout, expire)
+            completion.future.add_done_callback(
+                lambda future: self.remove_timeout(handle))
+        return completion.future
+
+    def discard(self, completion):
+        """Drop the not yet written writes of the given AV_Completion.
+
+        The writes are removed from the write queues of all devices, and
+        the completion is resolved as if they were coalesced away.
+        """
+        for dev in self.devices.values():
+            dev.discard_writes(completion)
 
     def get_ts(self):
-        return time.time() - self.t0
+        return self.time() - self.t0
 
     def run(self):
         """Run the I/O loop until aborted."""
@@ -89,5 +151,7 @@ class AV_Loop(IOLoop.configurable_default()):
         except KeyboardInterrupt:
             print("Aborted by Ctrl-C")
 
+        for dev in self.devices.values():
+            dev.close()
         self.close()
         return 0
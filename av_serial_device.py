@@ -3,6 +3,7 @@
 import serial
 
 from av_device import AV_Device
+from write_queue import AV_WriteQueue
 
 
 class AV_SerialDevice(AV_Device):
@@ -18,6 +19,10 @@ class AV_SerialDevice(AV_Device):
 
     DefaultBaudRate = 9600
 
+    DefaultMaxQueue = 32  # Max number of pending writes
+
+    DefaultDropPolicy = "oldest"  # See AV_WriteQueue
+
     @staticmethod
     def human_readable(s):
         """Convenience method for making byte strings human-readable.
@@ -43,6 +48,16 @@ class AV_SerialDevice(AV_Device):
             "--%s-baud" % (name), default=cls.DefaultBaudRate, metavar="BPS",
             help="Serial port baud rate for %s"
                  " (default: %%(default)s)" % (cls.Description))
+        arg_parser.add_argument(
+            "--%s-max-queue" % (name), type=int,
+            default=cls.DefaultMaxQueue, metavar="N",
+            help="Max number of pending writes to %s"
+                 " (default: %%(default)s)" % (cls.Description))
+        arg_parser.add_argument(
+            "--%s-drop-policy" % (name),
+            default=cls.DefaultDropPolicy, choices=AV_WriteQueue.DropPolicies,
+            help="Which write to drop when the write queue for %s is full"
+                 " (default: %%(default)s)" % (cls.Description))
 
     def __init__(self, av_loop, name):
         AV_Device.__init__(self, av_loop, name)
@@ -56,13 +71,33 @@ class AV_SerialDevice(AV_Device):
         self.ser.rtscts = False
         self.ser.timeout = 0  # Non-blocking reads
 
-        self.write_queue = []
+        self.write_queue = AV_WriteQueue(
+            *self.write_rules(),
+            max_depth=av_loop.args["%s_max_queue" % (name)],
+            drop_policy=av_loop.args["%s_drop_policy" % (name)],
+            clock=av_loop.time)
         self.write_ready = True
+        self.writes_held = False  # See hold_writes()
+
+        # (completion, data) of done writes, awaiting device feedback
+        self.unconfirmed = []
 
         self.av_loop.add_handler(
             self.ser.fileno(), self.handle_io, self.av_loop.READ)
         self.check_writable = False
 
+    def write_rules(self):
+        """Return the coalescing rules for queued writes to this device.
+
+        Return an (opposites, idempotent, supersedes) tuple, as expected
+        by AV_WriteQueue. Should be overridden in subclasses for devices
+        where writes may be coalesced.
+        """
+        return ({}, (), {})
+
+    def diagnostics(self):
+        return {"write_queue": self.write_queue.diagnostics()}
+
     def handle_io(self, fd, events):
         assert fd == self.ser.fileno()
         if events & self.av_loop.READ:
@@ -81,7 +116,7 @@ class AV_SerialDevice(AV_Device):
         if assign is not None:
             self.write_ready = assign
 
-        ret = self.write_ready and self.write_queue
+        ret = self.write_ready and not self.writes_held and self.write_queue
 
         events = self.av_loop.READ
         check_writable = False
@@ -94,6 +129,16 @@ class AV_SerialDevice(AV_Device):
             self.check_writable = check_writable
         return ret
 
+    def hold_writes(self, hold):
+        """Stop (or resume) performing queued writes.
+
+        While held, writes are still queued (and coalesced), but not
+        performed, e.g. so that a tool can write to the device directly
+        without its writes being interleaved with ours.
+        """
+        self.writes_held = hold
+        self.ready_to_write()
+
     def handle_read(self):
         """Attempt to read data from the serial port.
 
@@ -104,15 +149,59 @@ class AV_SerialDevice(AV_Device):
     def handle_write(self):
         """Attempt to write data to the serial port."""
         if self.ready_to_write():
-            data = self.write_queue.pop(0)
-            written = self.ser.write(data)
-            assert written == len(data)
-            self.debug("Wrote %u bytes (%s)" % (
-                written, " ".join(["%02x" % (b) for b in data])))
+            write = self.write_queue.pop()
+            written = self.ser.write(write.data)
+            assert written == len(write.data)
+            self.debug("Wrote %u bytes (%s)" % (written, write))
+            self.await_confirm(
+                [c for c in write.completions if c.wrote()], write.data)
             self.ready_to_write(False)
 
-    def schedule_write(self, data):
-        self.debug("Adding %u bytes to write queue (%s)" % (
-            len(data), " ".join(["%02x" % (b) for b in data])))
-        self.write_queue.append(data)
+    def schedule_write(self, data, completion=None, coalesce=True,
+                       priority="normal"):
+        """Queue the given data for writing to the serial port.
+
+        The write may be coalesced with other queued writes according to
+        write_rules(), unless coalesce is False. Writes are performed in
+        order of priority ("urgent", "normal" or "bulk"). If given, the
+        completion (see AV_Completion) is notified when the data is
+        written.
+        """
+        self.debug("Adding %u bytes to %s write queue (%s)" % (
+            len(data), priority, " ".join(["%02x" % (b) for b in data])))
+        self.await_confirm(
+            self.write_queue.push(data, completion, coalesce, priority))
         self.ready_to_write()
+
+    def discard_writes(self, completion):
+        self.await_confirm(self.write_queue.discard(completion))
+        self.ready_to_write()
+
+    def await_confirm(self, completions, data=None):
+        """Let the given completions await confirmation from the device.
+
+        data is the last write performed for the completions, or None
+        if unknown (e.g. when their last write was coalesced away).
+        """
+        if completions:
+            self.unconfirmed = [
+                (c, d) for c, d in self.unconfirmed if not c.done()]
+            self.unconfirmed.extend((c, data) for c in completions)
+
+    def confirm_writes(self, confirms=None):
+        """Report that the device has confirmed completed writes.
+
+        Should be called by subclasses when feedback from the device
+        shows that the commands written so far have taken effect. If
+        given, confirms(data) decides whether the feedback confirms the
+        given write (data may be None, see await_confirm()), and writes
+        that are not confirmed keep awaiting feedback. Otherwise, all
+        completed writes are confirmed.
+        """
+        unconfirmed = []
+        for completion, data in self.unconfirmed:
+            if confirms is None or confirms(data):
+                completion.reached("confirmed")
+            elif not completion.done():
+                unconfirmed.append((completion, data))
+        self.unconfirmed = unconfirmed
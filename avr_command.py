@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+from avr_dgram import AVR_Datagram
+
 
 class AVR_Command(object):
     """Encaspulate AVR remote control commands."""
@@ -78,6 +80,9 @@ class AVR_Command(object):
         "TONE":           bytes([0x82, 0x72, 0xC5, 0x3A]),
     }
 
+    # Reverse lookup of the above dict
+    Keywords = dict((v, k) for k, v in Commands.items())
+
     @classmethod
     def parse_dgram(cls, data):
         """Parse a datagram containing a command sent to the AVR.
@@ -95,13 +100,7 @@ class AVR_Command(object):
         assert isinstance(data, bytes)
         assert len(data) == 4, "Unexpected length"
 
-        # Reverse-lookup the 4-byte data value in the command dict
-        keyword = None
-        for k, v in cls.Commands.items():
-            if data == v:
-                keyword = k
-                break
-        return (data, keyword)
+        return (data, cls.Keywords.get(data))
 
     @classmethod
     def from_dgram(cls, dgram):
@@ -117,3 +116,28 @@ class AVR_Command(object):
 
     def dgram(self):
         return self.Commands[self.keyword]
+
+
+class AVR_CommandCodec(object):
+    """Translate between AVR_Command keywords and complete datagrams.
+
+    All PC->AVR datagrams (including protocol overhead and checksum) are
+    built once, up front, so that encoding and decoding a command is a
+    single dict lookup in either direction.
+    """
+
+    def __init__(self, dgram_spec=AVR_Datagram.PC_AVR_Command):
+        self.frames = {}  # Map keyword to full datagram
+        self.keywords = {}  # Map full datagram to keyword
+        for keyword, data in AVR_Command.Commands.items():
+            dgram = AVR_Datagram.build_dgram(data, dgram_spec)
+            self.frames[keyword] = dgram
+            self.keywords[dgram] = keyword
+
+    def encode(self, keyword):
+        """Return the full datagram for the given keyword."""
+        return self.frames[keyword]
+
+    def decode(self, dgram):
+        """Return the keyword for the given full datagram, or None."""
+        return self.keywords.get(bytes(dgram))
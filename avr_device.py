@@ -1,15 +1,28 @@
 #!/usr/bin/env python
 
+import os
 import sys
-import time
+import fcntl
 
 from av_serial_device import AV_SerialDevice
-from avr_command import AVR_Command
+from av_completion import AV_Completion
+from avr_command import AVR_CommandCodec
 from avr_dgram import AVR_Datagram
+from av_framer import AV_Framer
+from write_pacer import AV_WritePacer
 from avr_status import AVR_Status
 from avr_state import AVR_State
 
 
+class AVR_Trigger(str):
+    """An AVR_Command keyword that only wakes up part of the AVR display.
+
+    E.g. the first VOL UP only shows the current volume, if the volume is
+    not already showing. Writes of triggers are never coalesced.
+    """
+    pass
+
+
 class AVR_Device(AV_SerialDevice):
     """Simple wrapper for communicating with a Harman/Kardon AVR 430.
 
@@ -21,24 +34,75 @@ class AVR_Device(AV_SerialDevice):
 
     DefaultBaudRate = 38400
 
+    # Prebuilt datagrams for all AVR_Command keywords
+    Codec = AVR_CommandCodec()
+
+    # Coalescing rules for queued writes (see write_rules())
+    OppositeKeywords = (
+        ("VOL UP", "VOL DOWN"), ("DIGITAL UP", "DIGITAL DOWN"),
+        ("MUTE", "MUTE"))
+    SourceKeywords = (
+        "VID1", "VID2", "VID3", "VID4", "VID5", "DVD", "CD", "TAPE")
+    # "AM/FM" selects the tuner, but toggles its band when the tuner is
+    # already selected. It is thus neither idempotent nor superseded.
+    IdempotentKeywords = ("POWER ON", "POWER OFF") + SourceKeywords
+    SupersedeKeywords = (("POWER ON", "POWER OFF"), SourceKeywords)
+
+    # State fields whose change confirms a write of the given keywords
+    # (see confirms()). Any change in state confirms other keywords.
+    # "volume display" and "digital display" denote a display change that
+    # shows the volume/digital input (e.g. in response to a trigger).
+    ConfirmFields = (
+        (("POWER ON", "POWER OFF"), ("off", "standby")),
+        (("MUTE",), ("mute",)),
+        (("VOL UP", "VOL DOWN"), ("volume", "volume display")),
+        (SourceKeywords + ("AM/FM",), ("source",)),  # "AM" vs. "FM"
+        (("6CH/8CH", "DOLBY", "DTS", "STEREO"), ("surround",)),
+        (("DIGITAL", "DIGITAL UP", "DIGITAL DOWN"), ("digital display",)),
+    )
+
+    # Priority classes for queued writes (default is "normal")
+    UrgentKeywords = ("POWER ON", "POWER OFF", "MUTE")
+    BulkCommands = ("vol?",)  # Display refreshes not requested by users
+
+    # Skip decoding of status frames identical to the last accepted one
+    DedupFrames = True
+
+    # Give up on a volume target after this many steps in a row that
+    # neither changed nor showed the volume. A lost step is just retried.
+    MaxIdleSteps = 3
+
+    @classmethod
+    def register_args(cls, name, arg_parser):
+        super(AVR_Device, cls).register_args(name, arg_parser)
+        arg_parser.add_argument(
+            "--%s-no-dedup" % (name), action="store_true",
+            default=not cls.DedupFrames,
+            help="Decode every status frame from %s, even when identical"
+                 " to the previous frame" % (cls.Description))
+        arg_parser.add_argument(
+            "--%s-fixed-pacing" % (name), action="store_true",
+            help="Do not adapt the pacing of writes to %s from its status"
+                 " updates" % (cls.Description))
+
     def _toggle_standby(self):
         return ["POWER ON"] if self.state.standby else ["POWER OFF"]
 
     def _adjust_volume(self, amount=0):
-        up = amount > 0
-        amount = abs(amount)
+        keyword = "VOL UP" if amount > 0 else "VOL DOWN"
+        ret = [keyword] * abs(amount)
         # If volume is not currently showing, we need an extra trigger
         if not self.state.showing_volume:
-            amount += 1
+            ret.insert(0, AVR_Trigger(keyword))
             self.state.showing_volume = True
-        return ["VOL UP" if up else "VOL DOWN"] * amount
+        return ret
 
     def _adjust_digital(self, amount=0):
         up = amount > 0
         amount = abs(amount)
         # If digital is not currently showing, we need to trigger it
         if not self.state.showing_digital:
-            yield "DIGITAL"
+            yield AVR_Trigger("DIGITAL")
             self.state.showing_digital = True
         for _ in range(amount):
             yield "DIGITAL UP" if up else "DIGITAL DOWN"
@@ -64,8 +128,6 @@ class AVR_Device(AV_SerialDevice):
 
         "dig+": lambda self: self._adjust_digital(+1),
         "dig-": lambda self: self._adjust_digital(-1),
-
-        "update": lambda self: []  # We only _emit_ this command
     }
 
     def __init__(self, av_loop, name):
@@ -74,21 +136,59 @@ class AVR_Device(AV_SerialDevice):
         for subcmd in self.Commands:
             self.av_loop.add_cmd_handler(
                 "%s %s" % (self.name, subcmd), self.handle_cmd)
+        self.av_loop.add_cmd_handler(
+            "%s volume" % (self.name), self.handle_volume_cmd)
 
         self.status_handler = None
 
-        self.readbuf = bytes()
+        # The framer reads straight from the (non-blocking) tty fd
+        self.framer = AV_Framer(AVR_Datagram.AVR_PC_Status)
+        fl = fcntl.fcntl(self.ser.fileno(), fcntl.F_GETFL)
+        fcntl.fcntl(self.ser.fileno(), fcntl.F_SETFL, fl | os.O_NONBLOCK)
+
+        # The last status frame that was decoded, for skipping repeats
+        self.dedup = not av_loop.args["%s_no_dedup" % (name)]
+        self.last_dgram = None
+        self.last_status = None
+        self.frame_stats = {"frames": 0, "repeats": 0}
 
         # Don't start writing until a status update is received.
         self.write_ready = False
 
         # Write enabling needs to be delayed. See ready_to_write()
         self.write_timer = None  # or (timeout_handle, deadline)
+        self.pacer = AV_WritePacer(
+            adapt=not av_loop.args["%s_fixed_pacing" % (name)])
 
         self.state = AVR_State(self.name, self.av_loop)
+        self.confirm_fields = {}  # Map written data -> ConfirmFields
+        for keywords, fields in self.ConfirmFields:
+            for k in keywords:
+                self.confirm_fields[self.Codec.encode(k)] = fields
+
+        # Absolute volume requested by "volume" cmd. See steer_volume()
+        self.volume_target = None  # or (target dB, AV_Completion or None)
+        self.volume_step = None  # AV_Completion of last VOL UP/DOWN step
+        self.volume_from = None  # (volume, showing) before last step
+        self.idle_steps = 0  # Steps in a row that made no progress
+
+    def write_rules(self):
+        encode = self.Codec.encode
+        opposites = {}
+        for a, b in self.OppositeKeywords:
+            opposites[encode(a)] = encode(b)
+            opposites[encode(b)] = encode(a)
+        idempotent = [encode(k) for k in self.IdempotentKeywords]
+        supersedes = {}
+        for group, keywords in enumerate(self.SupersedeKeywords):
+            for k in keywords:
+                supersedes[encode(k)] = group
+        return (opposites, idempotent, supersedes)
 
     def _delayed_ready(self):
         self.write_timer = None
+        self.pacer.expired()  # No-op unless we're waiting for feedback
+        self.steer_volume()
         AV_SerialDevice.ready_to_write(self, True)
 
     def _setup_write_timer(self, deadline):
@@ -105,94 +205,229 @@ class AVR_Device(AV_SerialDevice):
             return AV_SerialDevice.ready_to_write(self)
 
         # assign == False indicates that we've just written to the AVR.
-        # In that case, we should nominally delay the next write for
-        # about a second.
+        # In that case, we should delay the next write until the AVR
+        # has reacted to this write (or the pacer's timeout expires).
         #
         # assign == True indicates that we've just received an updated
         # status from the AVR. In that case, we can reduce the
-        # remaining time-to-next-write down to about a quarter second
-        # (value determined by unscientific experiments).
-        deadline = time.time() + (assign and 0.25 or 1.0)
-        if assign is False:  # Disable writes for 1.0s
+        # remaining time-to-next-write down to the pacer's settle time.
+        #
+        # The pacer adapts both durations from how quickly, and how
+        # reliably, the AVR reacts to our writes.
+        if assign is False:  # Disable writes until timeout
             self.write_ready = False  # Disable writes immediately
-            self._setup_write_timer(deadline)
+            self._setup_write_timer(self.pacer.wrote(self.av_loop.time()))
         elif assign is True:  # Shorten write_timeout
+            deadline = self.pacer.feedback(self.av_loop.time())
             if self.write_timer and deadline > self.write_timer[1]:
                 pass  # Keep current timer
             elif self.write_timer or not self.write_ready:
                 # Shorten existing timer or setup new timer
                 self._setup_write_timer(deadline)
 
-    def handle_read(self, dgram_spec=AVR_Datagram.AVR_PC_Status):
-        """Attempt to read a datagram from the serial port.
+    def handle_read(self):
+        """Read and handle all available datagrams from the serial port.
 
-        Look for a bytes matching AVR_Datagram.expect_dgram_start(),
-        and read additional bytes until we have a byte sequence of
-        total length == AVR_Datagram.full_dgram_len().
+        Keep reading until the serial port has no more bytes for us, so
+        that a backlog of datagrams is handled in a single read event.
         """
-        d_start = AVR_Datagram.expect_dgram_start(dgram_spec)
-        assert isinstance(d_start, bytes)
-        d_len = AVR_Datagram.full_dgram_len(dgram_spec)
-        assert len(d_start) < d_len
-
-        assert len(self.readbuf) < d_len
-        # self.debug("Have %u bytes" % (len(self.readbuf)))
-        self.readbuf += self.ser.read(d_len - len(self.readbuf))
-        if len(self.readbuf) < d_len:
-            # self.debug("Incomplete dgram (got %u/%u bytes): %s" % (
-                        # len(self.readbuf), d_len,
-                        # self.human_readable(self.readbuf)))
+        while self.framer.fill_from_fd(self.ser.fileno()):
+            for dgram in self.framer.frames():
+                self.handle_dgram(dgram)
+
+    def handle_dgram(self, dgram, dgram_spec=AVR_Datagram.AVR_PC_Status):
+        """Handle a status datagram (a memoryview) from the AVR."""
+        self.frame_stats["frames"] += 1
+        if dgram == self.last_dgram and not self.state.off:
+            # The AVR repeats its status ~20 times per second while
+            # nothing happens. Skip decoding, and only refresh liveness.
+            self.frame_stats["repeats"] += 1
+            self.state.repeat(self.last_status)
             return
 
-        # Find start of datagram
-        i = self.readbuf.find(d_start)
-        if i < 0:  # beyond len(self.readbuf) - len(d_start)
-            # self.debug("No start of dgram in %u bytes: %s" % (
-                # len(self.readbuf),
-                # self.human_readable(self.readbuf)))
-            self.readbuf = self.readbuf[-(len(d_start) - 1):]
+        dgram = bytes(dgram)  # Outlive the framer's buffer
+        try:
+            data = AVR_Datagram.parse_dgram(dgram, dgram_spec)
+            status = AVR_Status.from_dgram(data)
+        except (AssertionError, ValueError) as e:
+            # The framer has verified the checksum, so this is unlikely
+            self.debug("Failed to parse status datagram: %s" % (e))
+            self.framer.record_bad("bad_payload", dgram)
             return
-        elif i > 0:  # dgram starts at index i
-            # self.debug("dgram starts at index %u in %s" % (i,
-                # self.human_readable(self.readbuf)))
-            self.readbuf = self.readbuf[i:]
-        assert self.readbuf.startswith(d_start)
-
-        if len(self.readbuf) < d_len:
-            return
-
-        # self.debug("parsing self.readbuf: %s" % (
-            # self.human_readable(self.readbuf)))
-        dgram, self.readbuf = self.readbuf[:d_len], self.readbuf[d_len:]
-        assert isinstance(dgram, bytes)
-        data = AVR_Datagram.parse_dgram(dgram, dgram_spec)
-        status = AVR_Status.from_dgram(data)
-        if self.state.update(status):
+        if self.dedup:
+            self.last_dgram, self.last_status = dgram, status
+        changed = self.state.update(status)
+        if changed:
             self.debug("%s\n\t\t-> %s" % (status, self.state))
+            evidence = set(changed)
+            if not changed.isdisjoint(("line1", "line2")):
+                if self.state.showing_volume:
+                    evidence.add("volume display")
+                if self.state.showing_digital:
+                    evidence.add("digital display")
+            self.confirm_writes(lambda data: self.confirms(data, evidence))
             if self.status_handler:
                 self.status_handler(status)
             self.ready_to_write(True)
+            self.steer_volume()
+
+    def confirms(self, data, changed):
+        """Return True iff the changed fields confirm a write of data."""
+        fields = self.confirm_fields.get(data)
+        return fields is None or not changed.isdisjoint(fields)
+
+    def diagnostics(self):
+        frames, repeats = self.frame_stats["frames"], \
+            self.frame_stats["repeats"]
+        ret = AV_SerialDevice.diagnostics(self)
+        ret.update({
+            "frames": frames,
+            "repeats": repeats,
+            "repeat_rate": frames and float(repeats) / frames or 0.0,
+            "framing": self.framer.diagnostics(),
+            "pacing": self.pacer.diagnostics(),
+            "watchdog": dict(self.state.watchdog_stats),
+        })
+        return ret
 
     def handle_cmd(self, cmd, rest):
+        completion = self.av_loop.completion
         if self.state.off:
             self.debug("Discarding '%s' while AVR is off" % (cmd))
+            if completion is not None:
+                completion.fail(RuntimeError("%s is off" % (self.name)))
             return
         self.debug("Handling '%s'" % (cmd))
         avr, cmd = cmd.split(" ", 1)
         assert avr == self.name
         assert cmd in self.Commands
         assert not rest
+        if cmd in ("vol+", "vol-"):  # Manual adjustment overrides target
+            self.set_volume_target(None)
         command = self.Commands[cmd]
         assert callable(command)
-        for command_str in command(self):
-            avr_cmd = AVR_Command(command_str)
-            dgram_spec = AVR_Datagram.PC_AVR_Command
-            dgram = AVR_Datagram.build_dgram(avr_cmd.dgram(), dgram_spec)
-            self.schedule_write(dgram)
+        bulk = cmd in self.BulkCommands
+        for keyword in command(self):
+            if bulk:
+                priority = "bulk"
+            elif keyword in self.UrgentKeywords:
+                priority = "urgent"
+            else:
+                priority = "normal"
+            self.schedule_write(
+                self.Codec.encode(keyword), completion,
+                not isinstance(keyword, AVR_Trigger), priority)
+
+    def handle_volume_cmd(self, cmd, rest):
+        """Handle "volume <dB>" by steering towards the given volume."""
+        completion = self.av_loop.completion
+        self.debug("Handling '%s %s'" % (cmd, rest))
+        try:
+            target = int(rest)
+        except ValueError:
+            target = None
+        lo, hi = AVR_Status.VolumeRange
+        if target is None or not lo <= target <= hi:
+            e = ValueError("Invalid volume '%s' for %s (must be %i..%i)" % (
+                rest, cmd, lo, hi))
+            self.debug("Discarding '%s %s': %s" % (cmd, rest, e))
+            if completion is not None:
+                completion.fail(e)
+            return
+        if self.state.off:
+            self.debug("Discarding '%s %s' while AVR is off" % (cmd, rest))
+            if completion is not None:
+                completion.fail(RuntimeError("%s is off" % (self.name)))
+            return
+        if completion is not None:
+            completion.defer()
+        self.set_volume_target(target, completion)
+
+    def set_volume_target(self, target, completion=None):
+        """Start steering towards the given volume (None to stop).
+
+        The completion of a previous, unreached target is resolved at
+        "queued", as it is superseded before taking effect. Once the given
+        completion is resolved by other means (e.g. it times out), the
+        target is dropped.
+        """
+        if self.volume_target is not None:
+            prev = self.volume_target[1]
+            if prev is not None:
+                prev.reached("queued", final=True)
+        self.volume_target = None if target is None else (target, completion)
+        self.volume_from = None
+        self.idle_steps = 0
+        if completion is not None:
+            completion.future.add_done_callback(
+                lambda future: self.drop_volume_target(completion))
+        self.steer_volume()
+
+    def drop_volume_target(self, completion):
+        """Stop steering towards the target of the given completion."""
+        if self.volume_target is not None and \
+                self.volume_target[1] is completion:
+            self.volume_target = None
+
+    def steer_volume(self):
+        """Take the next step (if any) towards the volume target.
+
+        This is a closed loop: at most one VOL UP/DOWN step is in flight
+        at any time, and the next step is decided from the volume that
+        the AVR reports after the previous step was confirmed (or lost).
+        Hence, lost steps and overshoot are corrected, and steps are sent
+        as fast as the write pacer allows. The target completion reaches
+        "confirmed" once the AVR reports the target volume, and fails if
+        MaxIdleSteps steps in a row bring no change in volume (e.g. the
+        AVR ignores us).
+        """
+        if self.volume_target is None:
+            return
+        target, completion = self.volume_target
+        if self.state.off:
+            self.volume_target = None
+            if completion is not None:
+                completion.fail(RuntimeError("%s is off" % (self.name)))
+            return
+        if self.volume_step is not None and (
+                self.volume_step.writes or self.pacer.awaiting()):
+            return  # Last step not yet written, or not yet reported
+
+        if self.volume_from is not None:  # Evaluate the last step
+            if (self.state.volume, self.state.showing_volume) == \
+                    self.volume_from:
+                self.idle_steps += 1
+            else:
+                self.idle_steps = 0
+            self.volume_from = None
+        if self.idle_steps >= self.MaxIdleSteps:
+            self.volume_target = None
+            if completion is not None:
+                completion.fail(RuntimeError(
+                    "%s volume stuck at %sdB" % (
+                        self.name, self.state.volume)))
+            return
+
+        if self.state.volume is None or not self.state.showing_volume:
+            keyword = AVR_Trigger("VOL UP")  # Show volume without changing
+        elif self.state.volume == target:
+            self.volume_target = None
+            if completion is not None:
+                completion.reached("confirmed")
+            return
+        elif self.state.volume < target:
+            keyword = "VOL UP"
+        else:
+            keyword = "VOL DOWN"
+        self.debug("Steering volume %s -> %idB: %s" % (
+            self.state.volume, target, keyword))
+        self.volume_from = (self.state.volume, self.state.showing_volume)
+        self.volume_step = AV_Completion("volume step", "written")
+        self.schedule_write(
+            self.Codec.encode(keyword), self.volume_step, False)
 
 
 def main(args):
-    import os
     import argparse
     from tornado.ioloop import IOLoop
 
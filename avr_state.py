@@ -1,19 +1,50 @@
 #!/usr/bin/env python
 
-import time
+from collections import namedtuple
 
 from avr_status import AVR_Status
 
 
+# Published on the AV_Loop's event_bus whenever an AVR_State changes
+AVR_StateChanged = namedtuple(
+    "AVR_StateChanged", ("name", "state", "changed", "version"))
+
+
 class AVR_State(object):
     """Encapsulate the current state of the Harman/Kardon AVR 430."""
 
+    # The state fields that are tracked for changes. The names of the
+    # fields that changed are published in AVR_StateChanged events.
+    Fields = ("off", "standby", "mute", "volume", "source", "surround",
+              "channels", "speakers", "line1", "line2")
+
+    # Map Fields to the (key, formatter) pairs that represent them in
+    # the JSON document. Fields not listed here are represented as-is
+    # by a key of the same name.
+    JSONKeys = {
+        "surround": (
+            ("surround", sorted),
+            ("surround_string", lambda s: AVR_Status.surround_string(s, 3)),
+            ("surround_str", AVR_Status.surround_str)),
+        "channels": (
+            ("channels", sorted),
+            ("channels_string", AVR_Status.channels_string)),
+        "speakers": (
+            ("speakers", sorted),
+            ("speakers_string", AVR_Status.speakers_string),
+            ("speakers_str", AVR_Status.speakers_str)),
+    }
+
     def __init__(self, name, av_loop):
         self.name = name
         self.av_loop = av_loop
 
         self.volume_triggered = False  # True iff volume trigger is sent
         self.watchdog = None  # Times out if we don't get status updates
+        self.last_seen = None  # Time of last watchdog refresh
+        self.watchdog_timeout = None
+        self.watchdog_stats = {
+            "refreshes": 0, "timer_ops": 0, "checks": 0, "fired": 0}
         self.showing_volume = False
         self.showing_digital = True
 
@@ -28,6 +59,9 @@ class AVR_State(object):
         self.line1 = None  # string
         self.line2 = None  # string
 
+        self.changed = set()  # Fields changed by the last update
+        self.version = 0  # Incremented on every change
+
         self.refresh_watchdog()
 
     def __str__(self):
@@ -53,41 +87,102 @@ class AVR_State(object):
             props.append("'%s'" % (self.line2))
         return "<AVR_State " + " ".join(props) + ">"
 
-    def json(self):
-        """Dump the current state as JSON."""
+    def as_dict(self, fields=None):
+        """Return the given (default: all) fields as a JSON-able dict.
+
+        Fields with derived keys (see JSONKeys) are expanded into all
+        their keys.
+        """
+        if fields is None:
+            fields = self.Fields
+        ret = {}
+        for field in fields:
+            value = getattr(self, field)
+            if field in self.JSONKeys:
+                for key, formatter in self.JSONKeys[field]:
+                    ret[key] = formatter(value)
+            else:
+                ret[field] = value
+        return ret
+
+    def json(self, fields=None):
+        """Dump the current state (or the given fields) as JSON."""
         import json
-        return json.dumps({
-            "off":             self.off,
-            "standby":         self.standby,
-            "mute":            self.mute,
-            "volume":          self.volume,
-            "surround":        list(self.surround),
-            "surround_string": AVR_Status.surround_string(self.surround, 3),
-            "surround_str":    AVR_Status.surround_str(self.surround),
-            "channels":        list(self.channels),
-            "channels_string": AVR_Status.channels_string(self.channels),
-            "speakers":        list(self.speakers),
-            "speakers_string": AVR_Status.speakers_string(self.speakers),
-            "speakers_str":    AVR_Status.speakers_str(self.speakers),
-            "source":          self.source,
-            "line1":           self.line1,
-            "line2":           self.line2,
-        })
+        return json.dumps(self.as_dict(fields))
+
+    def snapshot(self):
+        """Return the current values of all Fields, for diff()."""
+        return tuple(getattr(self, field) for field in self.Fields)
+
+    def diff(self, snapshot):
+        """Return the set of Fields that changed since the snapshot."""
+        return set(field for field, value in zip(self.Fields, snapshot)
+                   if getattr(self, field) != value)
+
+    def notify(self, changed):
+        """Record and publish the given set of changed fields."""
+        self.changed = changed
+        if changed:
+            self.version += 1
+            self.av_loop.event_bus.publish(AVR_StateChanged(
+                self.name, self, frozenset(changed), self.version))
 
     def trigger_watchdog(self):
+        pre_state = self.snapshot()
         self.off = True
         self.watchdog = None
-        self.av_loop.submit_cmd("%s update" % (self.name))
+        self.watchdog_stats["fired"] += 1
+        self.notify(self.diff(pre_state))
 
     def refresh_watchdog(self, timeout=0.5):
-        if self.watchdog:
-            self.av_loop.remove_timeout(self.watchdog)
+        """Postpone the watchdog until the given timeout from now.
+
+        This happens for every status frame, so it only records the time
+        of the refresh. The watchdog timer is not moved; when it fires,
+        check_watchdog() re-arms it for the postponed deadline, instead.
+        Thus, while status frames flow, we do one timer operation per
+        timeout period, rather than two per frame.
+        """
+        self.watchdog_stats["refreshes"] += 1
+        self.last_seen = self.av_loop.time()
+        self.watchdog_timeout = timeout
+        if self.watchdog is None:
+            self._arm_watchdog(self.last_seen + timeout)
+
+    def _arm_watchdog(self, deadline):
+        self.watchdog_stats["timer_ops"] += 1
         self.watchdog = self.av_loop.add_timeout(
-            time.time() + timeout, self.trigger_watchdog)
+            deadline, self.check_watchdog)
+
+    def check_watchdog(self):
+        self.watchdog = None
+        self.watchdog_stats["checks"] += 1
+        deadline = self.last_seen + self.watchdog_timeout
+        if self.av_loop.time() < deadline:  # Refreshed since armed
+            self._arm_watchdog(deadline)
+        else:
+            self.trigger_watchdog()
+
+    def repeat(self, status):
+        """Handle a status update identical to the last one given to
+        update().
+
+        Such an update cannot change our state, so only refresh the
+        watchdog and the display flags that may have been tweaked
+        since the last update().
+        """
+        self.showing_volume = status.volume() is not None
+        self.showing_digital = status.digital() is not None
+        self.refresh_watchdog()
 
     def update(self, status):
+        """Update our state from the given AVR_Status.
+
+        Return the set of Fields that changed (if any), which is also
+        published in an AVR_StateChanged event.
+        """
         # Record pre-update state, to compare to post-update state:
-        pre_state = str(self)
+        pre_state = self.snapshot()
 
         # Trigger wake from standby if we just went from OFF -> STANDBY
         wakeup = self.off and status.standby()
@@ -129,8 +224,6 @@ class AVR_State(object):
             self.av_loop.submit_cmd("%s on" % (self.name))
 
         # Figure out if we actually changed state
-        post_state = str(self)
-        if pre_state != post_state:
-            self.av_loop.submit_cmd("%s update" % (self.name))
-            return True
-        return False
+        changed = self.diff(pre_state)
+        self.notify(changed)
+        return changed
@@ -1,13 +1,268 @@
 #!/usr/bin/env python
 
+from collections import namedtuple
+
+
+# All the fields decoded from the VFD icons in a single AVR status update
+AVR_Icons = namedtuple(
+    "AVR_Icons", ("standby", "surround", "channels", "speakers", "source"))
+
+
+class AVR_IconDecoder(object):
+    """Decode the VFD icon bits of AVR status updates in one pass.
+
+    The decoder is compiled from a declarative icon map (see
+    AVR_Status.IconMap), which is turned into one 256-entry lookup
+    table per icon byte and field. Decoding a 14-byte icons string
+    then boils down to a handful of table lookups and set unions.
+    Decoded results are also cached, as the AVR keeps repeating the
+    same icons while nothing changes.
+    """
+
+    Fields = ("surround", "channels", "speakers", "source")
+
+    MaxCached = 256  # Flush the decode cache when it grows beyond this
+
+    def __init__(self, icon_map, icon_combos=()):
+        # Per field, a list of (byte index, 256-entry lookup table)
+        tables = [{} for _ in self.Fields]
+        empty = frozenset()
+        for field, byte, alternatives in icon_map:
+            table = tables[self.Fields.index(field)].setdefault(
+                byte, [empty] * 256)
+            for value in range(256):
+                for mask, name in alternatives:
+                    if value & mask:  # First matching alternative wins
+                        table[value] = table[value] | frozenset((name,))
+                        break
+        self.tables = [sorted(t.items()) for t in tables]
+
+        # Icons spanning several bytes; all (byte, mask) pairs must match
+        self.combos = [
+            (self.Fields.index(field), name, bits)
+            for field, name, bits in icon_combos]
+
+        self.cache = {}  # Map icons -> AVR_Icons
+
+    def decode(self, icons):
+        """Return an AVR_Icons tuple with all fields in the given icons.
+
+        The surround, channels and speakers fields are frozensets, and
+        the source field is a string (or None if zero or several
+        sources are active).
+        """
+        ret = self.cache.get(icons)
+        if ret is not None:
+            return ret
+
+        fields = []
+        for tables in self.tables:
+            names = frozenset()
+            for byte, table in tables:
+                hit = table[icons[byte]]
+                if hit:
+                    names = names | hit if names else hit
+            fields.append(names)
+        for field, name, bits in self.combos:
+            for byte, mask in bits:
+                if not icons[byte] & mask:
+                    break
+            else:
+                fields[field] = fields[field] | frozenset((name,))
+
+        surround, channels, speakers, sources = fields
+        ret = AVR_Icons(
+            not icons.strip(b"\0"),
+            surround,
+            channels,
+            speakers,
+            next(iter(sources)) if len(sources) == 1 else None)
+
+        if len(self.cache) >= self.MaxCached:
+            self.cache.clear()
+        self.cache[icons] = ret
+        return ret
+
 
 class AVR_Status(object):
     """Encapsulate a single AVR status update."""
 
+    VolumeRange = (-80, 10)  # Min/max volume (dB) shown by the AVR
+
+    # The following lists the reverse-engineered interpretation of
+    # icons[0:4] and how they correspond to the surround mode icons
+    # on the AVR front display:
+    #  DOLBY DIGITAL:               icons[0:4] == c0 00 00 00
+    #  DOLBY PRO LOGIC II:          icons[0:4] == 1c 00 00 00
+    #  DOLBY PRO LOGIC:             icons[0:4] == 18 00 00 00
+    #  DOLBY VIRTUAL:               icons[0:4] == 00 0c 00 00
+    #  DSP, SURR.OFF:               icons[0:4] == 00 00 01 86
+    #  L7 LOGIC 7:                  icons[0:4] == 00 00 18 00
+    #  SURR. OFF:                   icons[0:4] == 00 00 00 06
+    #  DSP, 5 CH.STEREO:            icons[0:4] == 00 00 01 e8
+    #  DTS:                         icons[0:4] == 00 00 c0 00
+    #  DSP:                         icons[0:4] == 00 00 01 80
+    #  DOLBY PLII, DOLBY HEADPHONE: icons[0:4] == 1c 30 00 00
+    #  DOLBY DIGITAL, STEREO:       icons[0:4] == c0 40 00 00
+    #  DOLBY DIGITAL EX:            icons[0:4] == e0 00 00 00
+    #
+    # icons[0:4]:
+    #   [0]       [1]       [2]       [3]
+    #   8421 8421 8421 8421 8421 8421 8421 8421
+    #   ^^^^ ^^^^ ^^^^ ^^^^ ^^^^ ^^^^ ^^^^ ^^^^
+    #   |||| |||| |||| |||| |||| |||| |||| |||?
+    #   |||| |||| |||| |||| |||| |||| |||| ||* _SURR.OFF_
+    #   |||| |||| |||| |||| |||| |||| |||| |** SURR.OFF
+    #   |||| |||| |||| |||| |||| |||| |||| * 57_CH.STEREO_
+    #   |||| |||| |||| |||| |||| |||| |||* 5_7_CH.STEREO
+    #   |||| |||| |||| |||| |||| |||| ||* _5_7CH.STEREO
+    #   |||| |||| |||| |||| |||| |||| |** 57CH.STEREO
+    #   |||| |||| |||| |||| |||| |||| * _DSP_
+    #   |||| |||| |||| |||| |||| |||** DSP
+    #   |||| |||| |||| |||| |||| ||* _VMax_
+    #   |||| |||| |||| |||| |||| |** VMax
+    #   |||| |||| |||| |||| |||| * _L7 LOGIC 7_
+    #   |||| |||| |||| |||| |||** L7 LOGIC 7
+    #   |||| |||| |||| |||| ||* DTS _ES_ ?
+    #   |||| |||| |||| |||| |* _DTS_ ES
+    #   |||| |||| |||| |||| ** DTS ES
+    #   |||| |||| |||| |||?
+    #   |||| |||| |||| ||?
+    #   |||| |||| |||| |* _DOLBY VIRTUAL_
+    #   |||| |||| |||| ** DOLBY VIRTUAL
+    #   |||| |||| |||* _DOLBY HEADPHONE_
+    #   |||| |||| ||** DOLBY HEADPHONE
+    #   |||| |||| |* DOLBY 3 _STEREO_
+    #   |||| |||| * DOLBY _3_ STEREO ?
+    #   |||| |||* _DOLBY_ 3 STEREO ?
+    #   |||| ||** DOLBY 3 STEREO ?
+    #   |||| |* DOLBY PRO LOGIC _II_
+    #   |||| * _DOLBY PRO LOGIC_ II
+    #   |||** DOLBY PRO LOGIC II
+    #   ||* DOLBY DIGITAL _EX_
+    #   |* _DOLBY DIGITAL_ EX
+    #   ** DOLBY DIGITAL EX
+    #
+    # The following lists the reverse-engineered interpretation of
+    # icons[4:8] and how they correspond to the channel/speaker icons
+    # on the AVR front display:
+    #
+    #  - icons[4] & 0x80: L (large)
+    #  - icons[4] & 0x40: L (small)
+    #  - icons[4] & 0x20: L (signal)
+    #  - icons[4] & 0x10: L (large) ?
+    #  - icons[4] & 0x08: C (large)
+    #  - icons[4] & 0x04: C (small)
+    #  - icons[4] & 0x02: C (signal)
+    #  - icons[4] & 0x01: C (large) ?
+    #  - icons[5] & 0x80: R (large)
+    #  - icons[5] & 0x40: R (small)
+    #  - icons[5] & 0x20: R (signal)
+    #  - icons[5] & 0x10: R (large) ?
+    #  - icons[5] & 0x08: LFE (present)
+    #  - icons[5] & 0x04: LFE (signal)
+    #  - icons[5] & 0x02: SL (large)
+    #  - icons[5] & 0x01: SL (small)
+    #  - icons[6] & 0x80: SL (signal)
+    #  - icons[6] & 0x40: SL (large) ?
+    #  - icons[6] & 0x20: (listener icon?)
+    #  - icons[6] & 0x10: SR (large)
+    #  - icons[6] & 0x08: SR (small)
+    #  - icons[6] & 0x04: SR (signal)
+    #  - icons[6] & 0x02: SR (large) ?
+    #  - icons[6] & 0x01: SBL (signal) ?
+    #  - icons[7] & 0x80: SBL (small)
+    #  - icons[7] & 0x40: SBL (signal)
+    #  - icons[7] & 0x20: SBL (large)
+    #  - icons[7] & 0x10: (line between SBL and SBR?)
+    #  - icons[7] & 0x08: SBR (large)
+    #  - icons[7] & 0x04: SBR (small)
+    #  - icons[7] & 0x02: SBR (signal)
+    #  - icons[7] & 0x01: SBR (large)
+    #
+    # The following lists the reverse-engineered interpretation of
+    # icons[8:12] and how they correspond to the source icons
+    # on the AVR front display:
+    #  DVD:  icons[8:12] == 30 00 00 00
+    #  CD:   icons[8:12] == 00 c0 00 00
+    #  TAPE: icons[8:12] == 00 00 60 00
+    #  6CH:  icons[8:12] == 00 00 06 00
+    #  8CH:  icons[8:12] == 00 00 00 60
+    #  VID1: icons[8:12] == c0 00 00 00
+    #  VID2: icons[8:12] == 03 00 00 00
+    #  VID3: icons[8:12] == 00 30 00 00
+    #  VID4: icons[8:12] == 00 01 80 00
+    #  FM:   icons[8:12] == 00 0c 00 00
+    #  AM:   icons[8:12] == 00 0a 00 00
+    #
+    # The icon bits are declared in the following table. Each entry is a
+    # (field, byte, alternatives) triple, where alternatives lists
+    # (mask, name) pairs. The name of the first pair whose mask matches
+    # icons[byte] is added to the given field. This table is compiled
+    # into per-byte lookup tables by AVR_IconDecoder at import time.
+    IconMap = (
+        ("surround", 0, ((0x20, "DOLBY DIGITAL EX"),
+                         (0x40, "DOLBY DIGITAL"))),
+        ("surround", 0, ((0x04, "DOLBY PRO LOGIC II"),
+                         (0x08, "DOLBY PRO LOGIC"))),
+        ("surround", 0, ((0x01, "DOLBY 3 STEREO"),)),
+        ("surround", 1, ((0x40, "STEREO"),)),
+        ("surround", 1, ((0x10, "DOLBY HEADPHONE"),)),
+        ("surround", 1, ((0x04, "DOLBY VIRTUAL"),)),
+        ("surround", 2, ((0x20, "DTS ES"), (0x40, "DTS"))),
+        ("surround", 2, ((0x08, "LOGIC 7"),)),
+        ("surround", 2, ((0x02, "VMAX"),)),
+        ("surround", 3, ((0x80, "DSP"),)),
+        ("surround", 3, ((0x10, "7CH.STEREO"), (0x20, "5CH.STEREO"))),
+        ("surround", 3, ((0x02, "SURR.OFF"),)),
+
+        ("channels", 4, ((0x20, "L"),)),  # left
+        ("channels", 4, ((0x02, "C"),)),  # center
+        ("channels", 5, ((0x20, "R"),)),  # right
+        ("channels", 5, ((0x04, "LFE"),)),  # low freq. effects/sub-woofer
+        ("channels", 6, ((0x80, "SL"),)),  # surround left
+        ("channels", 6, ((0x04, "SR"),)),  # surround right
+        ("channels", 7, ((0x40, "SBL"),)),  # surround back left
+        ("channels", 7, ((0x02, "SBR"),)),  # surround back right
+
+        ("speakers", 4, ((0x80, "L"), (0x40, "l"))),
+        ("speakers", 4, ((0x08, "C"), (0x04, "c"))),
+        ("speakers", 5, ((0x80, "R"), (0x40, "r"))),
+        ("speakers", 5, ((0x08, "LFE"),)),
+        ("speakers", 5, ((0x02, "SL"), (0x01, "sl"))),
+        ("speakers", 6, ((0x10, "SR"), (0x08, "sr"))),
+        ("speakers", 7, ((0x20, "SBL"), (0x80, "sbl"))),
+        ("speakers", 7, ((0x01, "SBR"), (0x04, "sbr"))),
+
+        ("source", 8, ((0x30, "DVD"),)),
+        ("source", 9, ((0xc0, "CD"),)),
+        ("source", 10, ((0x60, "TAPE"),)),
+        ("source", 10, ((0x06, "6CH"),)),
+        ("source", 11, ((0x60, "8CH"),)),
+        ("source", 8, ((0xc0, "VID1"),)),
+        ("source", 8, ((0x03, "VID2"),)),
+        ("source", 9, ((0x30, "VID3"),)),
+        ("source", 9, ((0x04, "FM"),)),  # 0x0c (shares 0x80 with "AM")
+        ("source", 9, ((0x02, "AM"),)),  # 0x0a (shares 0x80 with "FM")
+    )
+
+    # Icons that need bits in more than one byte. Each entry is a
+    # (field, name, bits) triple, where all (byte, mask) pairs in bits
+    # must match for the name to be added to the given field.
+    IconCombos = (
+        ("source", "VID4", ((9, 0x01), (10, 0x80))),
+    )
+
+    IconDecoder = AVR_IconDecoder(IconMap, IconCombos)
+
     @staticmethod
     def decode_avr_line(line):
         return line.replace("`", "\u2161")
 
+    @staticmethod
+    def encode_avr_line(line):
+        return line.replace("\u2161", "`").encode('ascii')
+
     @staticmethod
     def parse_dgram(data):
         """Parse a datagram containing status info from the AVR.
@@ -56,6 +311,7 @@ class AVR_Status(object):
         self.line1 = self.decode_avr_line(line1)
         self.line2 = self.decode_avr_line(line2)
         self.icons = icons
+        self.decoded = None  # AVR_Icons, see decode_icons()
 
     def __str__(self):
         return "<AVR_Status: '%s' '%s' %s/%s/%s -> %s>" % (
@@ -84,24 +340,31 @@ class AVR_Status(object):
     def dgram(self):
         """Create a datagram containing AVR status info.
 
-        Return a 58-byte datagram containing the information in this
+        Return a 48-byte datagram containing the information in this
         object, with the encoding explained in the parse_dgram() docs.
         """
         assert len(self.line1) == 14
         assert len(self.line2) == 14
         assert len(self.icons) == 14
         return (
-            chr(0xf0) + self.line1 + chr(0x00) +
-            chr(0xf1) + self.line2 + chr(0x00) +
-            chr(0xf2) + str(self.icons, 'ascii') + chr(0x00))
+            b"\xf0" + self.encode_avr_line(self.line1) + b"\x00" +
+            b"\xf1" + self.encode_avr_line(self.line2) + b"\x00" +
+            b"\xf2" + self.icons + b"\x00")
+
+    def decode_icons(self):
+        """Decode and return all fields of the VFD icons in one pass.
+
+        Return an AVR_Icons tuple, which is also used by standby(),
+        surround(), channels(), speakers() and source() below.
+        """
+        if self.decoded is None:
+            self.decoded = self.IconDecoder.decode(self.icons)
+        return self.decoded
 
     def standby(self):
         """Decode and return whether AVR is in standby mode."""
         # if self.icons is all 0x00, then assume we're in standby mode
-        for b in self.icons:
-            if b:
-                return False
-        return True
+        return self.decode_icons().standby
 
     def mute(self):
         """Decode and return whether AVR is in mute mode."""
@@ -143,95 +406,7 @@ class AVR_Status(object):
          - "5CH.STEREO" or "7CH.STEREO"
          - "SURR.OFF"
         """
-        # The following lists the reverse-engineered interpretation of
-        # icons[0:4] and how they correspond to the surround mode icons
-        # on the AVR front display:
-        #  DOLBY DIGITAL:               icons[0:4] == c0 00 00 00
-        #  DOLBY PRO LOGIC II:          icons[0:4] == 1c 00 00 00
-        #  DOLBY PRO LOGIC:             icons[0:4] == 18 00 00 00
-        #  DOLBY VIRTUAL:               icons[0:4] == 00 0c 00 00
-        #  DSP, SURR.OFF:               icons[0:4] == 00 00 01 86
-        #  L7 LOGIC 7:                  icons[0:4] == 00 00 18 00
-        #  SURR. OFF:                   icons[0:4] == 00 00 00 06
-        #  DSP, 5 CH.STEREO:            icons[0:4] == 00 00 01 e8
-        #  DTS:                         icons[0:4] == 00 00 c0 00
-        #  DSP:                         icons[0:4] == 00 00 01 80
-        #  DOLBY PLII, DOLBY HEADPHONE: icons[0:4] == 1c 30 00 00
-        #  DOLBY DIGITAL, STEREO:       icons[0:4] == c0 40 00 00
-        #  DOLBY DIGITAL EX:            icons[0:4] == e0 00 00 00
-        #
-        # icons[0:4]:
-        #   [0]       [1]       [2]       [3]
-        #   8421 8421 8421 8421 8421 8421 8421 8421
-        #   ^^^^ ^^^^ ^^^^ ^^^^ ^^^^ ^^^^ ^^^^ ^^^^
-        #   |||| |||| |||| |||| |||| |||| |||| |||?
-        #   |||| |||| |||| |||| |||| |||| |||| ||* _SURR.OFF_
-        #   |||| |||| |||| |||| |||| |||| |||| |** SURR.OFF
-        #   |||| |||| |||| |||| |||| |||| |||| * 57_CH.STEREO_
-        #   |||| |||| |||| |||| |||| |||| |||* 5_7_CH.STEREO
-        #   |||| |||| |||| |||| |||| |||| ||* _5_7CH.STEREO
-        #   |||| |||| |||| |||| |||| |||| |** 57CH.STEREO
-        #   |||| |||| |||| |||| |||| |||| * _DSP_
-        #   |||| |||| |||| |||| |||| |||** DSP
-        #   |||| |||| |||| |||| |||| ||* _VMax_
-        #   |||| |||| |||| |||| |||| |** VMax
-        #   |||| |||| |||| |||| |||| * _L7 LOGIC 7_
-        #   |||| |||| |||| |||| |||** L7 LOGIC 7
-        #   |||| |||| |||| |||| ||* DTS _ES_ ?
-        #   |||| |||| |||| |||| |* _DTS_ ES
-        #   |||| |||| |||| |||| ** DTS ES
-        #   |||| |||| |||| |||?
-        #   |||| |||| |||| ||?
-        #   |||| |||| |||| |* _DOLBY VIRTUAL_
-        #   |||| |||| |||| ** DOLBY VIRTUAL
-        #   |||| |||| |||* _DOLBY HEADPHONE_
-        #   |||| |||| ||** DOLBY HEADPHONE
-        #   |||| |||| |* DOLBY 3 _STEREO_
-        #   |||| |||| * DOLBY _3_ STEREO ?
-        #   |||| |||* _DOLBY_ 3 STEREO ?
-        #   |||| ||** DOLBY 3 STEREO ?
-        #   |||| |* DOLBY PRO LOGIC _II_
-        #   |||| * _DOLBY PRO LOGIC_ II
-        #   |||** DOLBY PRO LOGIC II
-        #   ||* DOLBY DIGITAL _EX_
-        #   |* _DOLBY DIGITAL_ EX
-        #   ** DOLBY DIGITAL EX
-
-        buf = self.icons[0:4]
-        ret = set()
-        if buf[0] & 0x20:
-            ret.add("DOLBY DIGITAL EX")
-        elif buf[0] & 0x40:
-            ret.add("DOLBY DIGITAL")
-        if buf[0] & 0x04:
-            ret.add("DOLBY PRO LOGIC II")
-        elif buf[0] & 0x08:
-            ret.add("DOLBY PRO LOGIC")
-        if buf[0] & 0x01:
-            ret.add("DOLBY 3 STEREO")
-        if buf[1] & 0x40:
-            ret.add("STEREO")
-        if buf[1] & 0x10:
-            ret.add("DOLBY HEADPHONE")
-        if buf[1] & 0x04:
-            ret.add("DOLBY VIRTUAL")
-        if buf[2] & 0x20:
-            ret.add("DTS ES")
-        elif buf[2] & 0x40:
-            ret.add("DTS")
-        if buf[2] & 0x08:
-            ret.add("LOGIC 7")
-        if buf[2] & 0x02:
-            ret.add("VMAX")
-        if buf[3] & 0x80:
-            ret.add("DSP")
-        if buf[3] & 0x10:
-            ret.add("7CH.STEREO")
-        elif buf[3] & 0x20:
-            ret.add("5CH.STEREO")
-        if buf[3] & 0x02:
-            ret.add("SURR.OFF")
-        return ret
+        return self.decode_icons().surround
 
     @staticmethod
     def surround_string(surround_set, limit_width=100):
@@ -275,43 +450,6 @@ class AVR_Status(object):
         }
         return "+".join(sorted([d[s] for s in surround_set]))
 
-    # The following lists the reverse-engineered interpretation of
-    # icons[4:8] and how they correspond to the channel/speaker icons
-    # on the AVR front display:
-    #
-    #  - icons[4] & 0x80: L (large)
-    #  - icons[4] & 0x40: L (small)
-    #  - icons[4] & 0x20: L (signal)
-    #  - icons[4] & 0x10: L (large) ?
-    #  - icons[4] & 0x08: C (large)
-    #  - icons[4] & 0x04: C (small)
-    #  - icons[4] & 0x02: C (signal)
-    #  - icons[4] & 0x01: C (large) ?
-    #  - icons[5] & 0x80: R (large)
-    #  - icons[5] & 0x40: R (small)
-    #  - icons[5] & 0x20: R (signal)
-    #  - icons[5] & 0x10: R (large) ?
-    #  - icons[5] & 0x08: LFE (present)
-    #  - icons[5] & 0x04: LFE (signal)
-    #  - icons[5] & 0x02: SL (large)
-    #  - icons[5] & 0x01: SL (small)
-    #  - icons[6] & 0x80: SL (signal)
-    #  - icons[6] & 0x40: SL (large) ?
-    #  - icons[6] & 0x20: (listener icon?)
-    #  - icons[6] & 0x10: SR (large)
-    #  - icons[6] & 0x08: SR (small)
-    #  - icons[6] & 0x04: SR (signal)
-    #  - icons[6] & 0x02: SR (large) ?
-    #  - icons[6] & 0x01: SBL (signal) ?
-    #  - icons[7] & 0x80: SBL (small)
-    #  - icons[7] & 0x40: SBL (signal)
-    #  - icons[7] & 0x20: SBL (large)
-    #  - icons[7] & 0x10: (line between SBL and SBR?)
-    #  - icons[7] & 0x08: SBR (large)
-    #  - icons[7] & 0x04: SBR (small)
-    #  - icons[7] & 0x02: SBR (signal)
-    #  - icons[7] & 0x01: SBR (large)
-
     def channels(self):
         """Decode and return the channels present in the input signal.
 
@@ -331,25 +469,7 @@ class AVR_Status(object):
          - A 5.1 surround signal will also contain C, LFE, SL and SR
          - A 7.1 surround signal will also contains SBL and SBR
         """
-        buf = self.icons[4:8]
-        ret = set()
-        if buf[0] & 0x20:
-            ret.add("L")  # left
-        if buf[0] & 0x02:
-            ret.add("C")  # center
-        if buf[1] & 0x20:
-            ret.add("R")  # right
-        if buf[1] & 0x04:
-            ret.add("LFE")  # low freq. effects/sub-woofer
-        if buf[2] & 0x80:
-            ret.add("SL")  # surround left
-        if buf[2] & 0x04:
-            ret.add("SR")  # surround right
-        if buf[3] & 0x40:
-            ret.add("SBL")  # surround back left
-        if buf[3] & 0x02:
-            ret.add("SBR")  # surround back right
-        return ret
+        return self.decode_icons().channels
 
     @staticmethod
     def channels_string(channels_set):
@@ -385,39 +505,7 @@ class AVR_Status(object):
         "SURROUND OFF" mode, the set will not contain the surround
         speakers, although they are still physically connected.
         """
-        buf = self.icons[4:8]
-        ret = set()
-        if buf[0] & 0x80:
-            ret.add("L")
-        elif buf[0] & 0x40:
-            ret.add("l")
-        if buf[0] & 0x08:
-            ret.add("C")
-        elif buf[0] & 0x04:
-            ret.add("c")
-        if buf[1] & 0x80:
-            ret.add("R")
-        elif buf[1] & 0x40:
-            ret.add("r")
-        if buf[1] & 0x08:
-            ret.add("LFE")
-        if buf[1] & 0x02:
-            ret.add("SL")
-        elif buf[1] & 0x01:
-            ret.add("sl")
-        if buf[2] & 0x10:
-            ret.add("SR")
-        elif buf[2] & 0x08:
-            ret.add("sr")
-        if buf[3] & 0x20:
-            ret.add("SBL")
-        elif buf[3] & 0x80:
-            ret.add("sbl")
-        if buf[3] & 0x01:
-            ret.add("SBR")
-        elif buf[3] & 0x04:
-            ret.add("sbr")
-        return ret
+        return self.decode_icons().speakers
 
     @staticmethod
     def speakers_string(speakers_set):
@@ -456,45 +544,4 @@ class AVR_Status(object):
         Only one of these is active at any time, except when the AVR is
         off/standby, or while booting, in which case None is returned
         """
-        # The following lists the reverse-engineered interpretation of
-        # icons[8:12] and how they correspond to the source icons
-        # on the AVR front display:
-        #  DVD:  icons[8:12] == 30 00 00 00
-        #  CD:   icons[8:12] == 00 c0 00 00
-        #  TAPE: icons[8:12] == 00 00 60 00
-        #  6CH:  icons[8:12] == 00 00 06 00
-        #  8CH:  icons[8:12] == 00 00 00 60
-        #  VID1: icons[8:12] == c0 00 00 00
-        #  VID2: icons[8:12] == 03 00 00 00
-        #  VID3: icons[8:12] == 00 30 00 00
-        #  VID4: icons[8:12] == 00 01 80 00
-        #  FM:   icons[8:12] == 00 0c 00 00
-        #  AM:   icons[8:12] == 00 0a 00 00
-        buf = self.icons[8:12]
-        ret = set()
-        if buf[0] & 0x30:
-            ret.add("DVD")
-        if buf[1] & 0xc0:
-            ret.add("CD")
-        if buf[2] & 0x60:
-            ret.add("TAPE")
-        if buf[2] & 0x06:
-            ret.add("6CH")
-        if buf[3] & 0x60:
-            ret.add("8CH")
-        if buf[0] & 0xc0:
-            ret.add("VID1")
-        if buf[0] & 0x03:
-            ret.add("VID2")
-        if buf[1] & 0x30:
-            ret.add("VID3")
-        if buf[1] & 0x01 and buf[2] & 0x80:
-            ret.add("VID4")
-        if buf[1] & 0x04:
-            ret.add("FM")  # 0x0c (shares 0x80 with "AM")
-        if buf[1] & 0x02:
-            ret.add("AM")  # 0x0a (shares 0x80 with "FM")
-        if len(ret) == 1:
-            return ret.pop()
-        else:
-            return None
+        return self.decode_icons().source
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+"""
+Micro-benchmark the decoding of AVR status icons.
+
+Compare the per-frame cost of decoding all icon fields with the
+table-driven AVR_IconDecoder against the original one-bit-at-a-time
+decoding methods of AVR_Status (reproduced in Legacy_Decoder below),
+and verify that both decoders agree.
+"""
+
+import sys
+import random
+import timeit
+
+from avr_status import AVR_Status
+
+
+class Legacy_Decoder(object):
+    """The original if-chain decoding methods of AVR_Status."""
+
+    def __init__(self, icons):
+        self.icons = icons
+
+    def standby(self):
+        for b in self.icons:
+            if b:
+                return False
+        return True
+
+    def surround(self):
+        buf = self.icons[0:4]
+        ret = set()
+        if buf[0] & 0x20:
+            ret.add("DOLBY DIGITAL EX")
+        elif buf[0] & 0x40:
+            ret.add("DOLBY DIGITAL")
+        if buf[0] & 0x04:
+            ret.add("DOLBY PRO LOGIC II")
+        elif buf[0] & 0x08:
+            ret.add("DOLBY PRO LOGIC")
+        if buf[0] & 0x01:
+            ret.add("DOLBY 3 STEREO")
+        if buf[1] & 0x40:
+            ret.add("STEREO")
+        if buf[1] & 0x10:
+            ret.add("DOLBY HEADPHONE")
+        if buf[1] & 0x04:
+            ret.add("DOLBY VIRTUAL")
+        if buf[2] & 0x20:
+            ret.add("DTS ES")
+        elif buf[2] & 0x40:
+            ret.add("DTS")
+        if buf[2] & 0x08:
+            ret.add("LOGIC 7")
+        if buf[2] & 0x02:
+            ret.add("VMAX")
+        if buf[3] & 0x80:
+            ret.add("DSP")
+        if buf[3] & 0x10:
+            ret.add("7CH.STEREO")
+        elif buf[3] & 0x20:
+            ret.add("5CH.STEREO")
+        if buf[3] & 0x02:
+            ret.add("SURR.OFF")
+        return ret
+
+    def channels(self):
+        buf = self.icons[4:8]
+        ret = set()
+        if buf[0] & 0x20:
+            ret.add("L")
+        if buf[0] & 0x02:
+            ret.add("C")
+        if buf[1] & 0x20:
+            ret.add("R")
+        if buf[1] & 0x04:
+            ret.add("LFE")
+        if buf[2] & 0x80:
+            ret.add("SL")
+        if buf[2] & 0x04:
+            ret.add("SR")
+        if buf[3] & 0x40:
+            ret.add("SBL")
+        if buf[3] & 0x02:
+            ret.add("SBR")
+        return ret
+
+    def speakers(self):
+        buf = self.icons[4:8]
+        ret = set()
+        if buf[0] & 0x80:
+            ret.add("L")
+        elif buf[0] & 0x40:
+            ret.add("l")
+        if buf[0] & 0x08:
+            ret.add("C")
+        elif buf[0] & 0x04:
+            ret.add("c")
+        if buf[1] & 0x80:
+            ret.add("R")
+        elif buf[1] & 0x40:
+            ret.add("r")
+        if buf[1] & 0x08:
+            ret.add("LFE")
+        if buf[1] & 0x02:
+            ret.add("SL")
+        elif buf[1] & 0x01:
+            ret.add("sl")
+        if buf[2] & 0x10:
+            ret.add("SR")
+        elif buf[2] & 0x08:
+            ret.add("sr")
+        if buf[3] & 0x20:
+            ret.add("SBL")
+        elif buf[3] & 0x80:
+            ret.add("sbl")
+        if buf[3] & 0x01:
+            ret.add("SBR")
+        elif buf[3] & 0x04:
+            ret.add("sbr")
+        return ret
+
+    def source(self):
+        buf = self.icons[8:12]
+        ret = set()
+        if buf[0] & 0x30:
+            ret.add("DVD")
+        if buf[1] & 0xc0:
+            ret.add("CD")
+        if buf[2] & 0x60:
+            ret.add("TAPE")
+        if buf[2] & 0x06:
+            ret.add("6CH")
+        if buf[3] & 0x60:
+            ret.add("8CH")
+        if buf[0] & 0xc0:
+            ret.add("VID1")
+        if buf[0] & 0x03:
+            ret.add("VID2")
+        if buf[1] & 0x30:
+            ret.add("VID3")
+        if buf[1] & 0x01 and buf[2] & 0x80:
+            ret.add("VID4")
+        if buf[1] & 0x04:
+            ret.add("FM")
+        if buf[1] & 0x02:
+            ret.add("AM")
+        if len(ret) == 1:
+            return ret.pop()
+        else:
+            return None
+
+    def decode_icons(self):
+        return (self.standby(), self.surround(), self.channels(),
+                self.speakers(), self.source())
+
+
+def verify(samples):
+    """Check that the table decoder agrees with the legacy decoder."""
+    decoder = AVR_Status.IconDecoder
+    for icons in samples:
+        expect = Legacy_Decoder(icons).decode_icons()
+        actual = tuple(decoder.decode(icons))
+        assert actual == expect, "%r: %r != %r" % (icons, actual, expect)
+    return len(samples)
+
+
+def main(args):
+    rnd = random.Random(0)
+    n = int(args[0]) if args else 100000
+
+    # Every value in every icon byte, and a bunch of random icons
+    samples = []
+    for i in range(12):
+        for v in range(256):
+            icons = bytearray(14)
+            icons[i] = v
+            samples.append(bytes(icons))
+    samples += [bytes(rnd.getrandbits(8) for _ in range(12)) + bytes(2)
+                for _ in range(10000)]
+    print("Verified %u icon samples" % (verify(samples)))
+
+    # Typical frames: the AVR repeats a few distinct icons over and over
+    frame = AVR_Status(
+        "DVD           ", "DOLBY DIGITAL ",
+        bytes([0xc0, 0x00, 0x00, 0x00, 0xfd, 0xfb, 0x7a, 0x00, 0xc0]
+              + [0x00] * 5))
+
+    def legacy():
+        d = Legacy_Decoder(frame.icons)
+        # __str__ and AVR_State.update() used to decode each field
+        # at least twice per frame
+        for _ in range(2):
+            d.surround(), d.channels(), d.speakers(), d.source()
+        d.standby()
+
+    def table():
+        frame.decoded = None  # Decode every frame from scratch
+        frame.decode_icons()
+
+    def table_uncached():
+        AVR_Status.IconDecoder.cache.clear()
+        table()
+
+    for name, func in (
+            ("legacy methods", legacy),
+            ("table decoder (uncached)", table_uncached),
+            ("table decoder", table)):
+        t = timeit.timeit(func, number=n)
+        print("%-26s %7.2f us/frame" % (name + ":", t / n * 1e6))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
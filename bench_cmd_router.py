@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""
+Benchmark A/V command dispatch: AV_CommandRouter vs. the old submit_cmd().
+
+Register the same handlers as av_control.py does (AVR, HDMI switch and
+the catch-all), and dispatch a realistic mix of commands: mostly volume
+steps, some source and surround changes, and the odd unknown command.
+"""
+
+import sys
+import time
+
+from cmd_router import AV_CommandRouter
+from avr_device import AVR_Device
+from hdmi_switch import HDMI_Switch
+
+
+class Legacy_Router(object):
+    """AV_Loop.submit_cmd() before AV_CommandRouter."""
+
+    def __init__(self):
+        self.cmd_handlers = {}
+
+    def add(self, cmd, handler):
+        if cmd in self.cmd_handlers:
+            self.cmd_handlers[cmd].append(handler)
+        else:
+            self.cmd_handlers[cmd] = [handler]
+
+    def dispatch(self, cmd):
+        pre_words = cmd.strip().split()
+        post_words = []
+
+        def _invoke(cmd, rest):
+            if cmd not in self.cmd_handlers:
+                return None
+            for handler in self.cmd_handlers[cmd]:
+                handler(cmd, rest)
+            return cmd
+
+        while pre_words:
+            pre_cmd = " ".join(pre_words)
+            if pre_cmd in self.cmd_handlers:
+                return _invoke(pre_cmd, " ".join(post_words))
+            post_words.insert(0, pre_words.pop())
+        return _invoke("", " ".join(post_words))
+
+
+class Uncached_Router(AV_CommandRouter):
+    """AV_CommandRouter without its lookup cache."""
+
+    lookup = AV_CommandRouter.match
+
+
+def setup(router, handler):
+    for subcmd in AVR_Device.Commands:
+        router.add("avr %s" % (subcmd), handler)
+    for subcmd in HDMI_Switch.Commands:
+        router.add("hdmi %s" % (subcmd), handler)
+    router.add("", handler)  # Catch-all
+
+
+Workload = (
+    ["avr vol+"] * 40 + ["avr vol-"] * 40 +
+    ["avr mute", "avr on_off", "avr source vid1", "hdmi 2",
+     "avr surround dolby", "avr surround stereo",
+     "avr dig+", "hdmi off", "foo bar baz", "avr bogus command"])
+
+
+def run(router, n):
+    calls = []
+    setup(router, lambda cmd, rest: calls.append((cmd, rest)))
+    cmds = (Workload * (n // len(Workload) + 1))[:n]
+    t = time.time()
+    for cmd in cmds:
+        router.dispatch(cmd)
+    t = time.time() - t
+    return t / n, calls
+
+
+def main(args):
+    n = int(args[0]) if args else 100000
+    old_t, old_calls = run(Legacy_Router(), n)
+
+    uncached_t, uncached_calls = run(Uncached_Router(), n)
+
+    new_t, new_calls = run(AV_CommandRouter(), n)
+    assert old_calls == uncached_calls == new_calls
+
+    print("Dispatched %u commands (%u distinct) to %u handlers" % (
+        n, len(set(Workload)), len(AVR_Device.Commands)
+        + len(HDMI_Switch.Commands) + 1))
+    print("%-24s %8.2f us/cmd" % ("old submit_cmd()", old_t * 1e6))
+    print("%-24s %8.2f us/cmd" % ("scan, uncached", uncached_t * 1e6))
+    print("%-24s %8.2f us/cmd" % ("scan, cached", new_t * 1e6))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""
+Benchmark command ingress latency: /cmd/ over HTTP vs. AV_CommandSocket.
+
+Run an AV_Loop with an AV_HTTPServer and an AV_CommandSocket in a
+background thread, and measure the time from a client sending a command
+until the command handler is invoked in the AV_Loop. HTTP is measured
+both with a new connection per command (like the XBMC default.py
+script does) and over a single persistent connection.
+"""
+
+import sys
+import time
+import socket
+import argparse
+import threading
+import http.client
+from tornado.ioloop import IOLoop
+
+from av_loop import AV_Loop
+from http_server import AV_HTTPServer
+from cmd_socket import AV_CommandSocket
+
+
+SocketPath = "/tmp/bench_cmd_socket.sock"
+HTTPPort = 18000
+UDPPort = 18001
+
+
+class Bench_Receiver(object):
+    """Record the time at which each "bench ping" command arrives."""
+
+    def __init__(self, av_loop):
+        self.arrived = threading.Event()
+        self.t = None
+        av_loop.add_cmd_handler("bench ping", self.handle_ping)
+
+    def handle_ping(self, cmd, rest):
+        self.t = time.time()
+        self.arrived.set()
+
+    def measure(self, send):
+        self.arrived.clear()
+        t = time.time()
+        send()
+        if not self.arrived.wait(1.0):
+            raise RuntimeError("Command was not received")
+        return self.t - t
+
+
+def http_oneshot():
+    conn = http.client.HTTPConnection("127.0.0.1", HTTPPort)
+    conn.request("GET", "/cmd/bench/ping")
+    conn.getresponse().read()
+    conn.close()
+
+
+def http_keepalive_sender():
+    conn = http.client.HTTPConnection("127.0.0.1", HTTPPort)
+
+    def send():
+        conn.request("GET", "/cmd/bench/ping")
+        conn.getresponse().read()
+    return send
+
+
+def unix_sender():
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    return lambda: sock.sendto(b"bench ping\n", SocketPath)
+
+
+def udp_sender():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    return lambda: sock.sendto(b"bench ping\n", ("127.0.0.1", UDPPort))
+
+
+def main(args):
+    n = int(args[0]) if args else 1000
+
+    parser = argparse.ArgumentParser()
+    AV_HTTPServer.register_args("http", parser)
+    AV_CommandSocket.register_args("sock", parser)
+    IOLoop.configure(AV_Loop, parsed_args=vars(parser.parse_args([
+        "--http-port", str(HTTPPort),
+        "--sock-path", SocketPath, "--sock-port", str(UDPPort)])))
+    mainloop = IOLoop.instance()
+    mainloop.add_device("http", AV_HTTPServer(mainloop, "http"))
+    sock = AV_CommandSocket(mainloop, "sock")
+    mainloop.add_device("sock", sock)
+    receiver = Bench_Receiver(mainloop)
+
+    loop_thread = threading.Thread(target=mainloop.start)
+    loop_thread.start()
+    try:
+        print("%-24s %10s %10s" % ("transport", "median", "99th pct"))
+        for name, send in (
+                ("HTTP, new connection", http_oneshot),
+                ("HTTP, keep-alive", http_keepalive_sender()),
+                ("Unix datagram socket", unix_sender()),
+                ("UDP", udp_sender())):
+            receiver.measure(send)  # Warm up
+            samples = sorted(receiver.measure(send) for i in range(n))
+            print("%-24s %7.1f us %7.1f us" % (
+                name, samples[n // 2] * 1e6, samples[n * 99 // 100] * 1e6))
+    finally:
+        mainloop.add_callback(mainloop.stop)
+        loop_thread.join()
+        sock.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""
+Benchmark broadcasting of AVR state changes to /events subscribers.
+
+Simulate a volume ramp with dozens to hundreds of connected clients,
+and compare the per-update cost of AV_EventHub (which encodes each
+state version once) against encoding the state separately for each
+client (like EventHandler used to do).
+"""
+
+import sys
+import time
+
+from event_bus import AV_EventBus
+from avr_state import AVR_State, AVR_StateChanged
+from avr_status import AVR_Status
+from http_server import AV_EventHub
+
+
+class Bench_Loop(object):
+    """The bare minimum of AV_Loop needed by AVR_State and AV_EventHub."""
+
+    def __init__(self):
+        self.devices = {}
+        self.cmd_handlers = {}
+        self.event_bus = AV_EventBus()
+
+    def add_cmd_handler(self, cmd, handler):
+        self.cmd_handlers.setdefault(cmd, []).append(handler)
+
+    def submit_cmd(self, cmd):
+        words = cmd.split()
+        for handler in self.cmd_handlers.get(" ".join(words[:2]), []):
+            handler(" ".join(words[:2]), " ".join(words[2:]))
+
+    def time(self):
+        return time.time()
+
+    def add_timeout(self, deadline, callback):
+        return None
+
+    def remove_timeout(self, timeout):
+        pass
+
+
+class Bench_Device(object):
+
+    def __init__(self, av_loop, name):
+        self.state = AVR_State(name, av_loop)
+
+
+class Bench_Client(object):
+    """Simulated /events subscriber."""
+
+    Format = "sse"
+
+    def __init__(self, fields=AVR_State.Fields):
+        self.fields = fields
+        self.received = 0
+
+    def send(self, buf):
+        self.received += len(buf)
+
+    def buffered(self):
+        return 0
+
+    def closed(self):
+        return False
+
+    def disconnect(self):
+        pass
+
+    def emit_avr_update(self, state):
+        """Encode the full state for this client only (the old way)."""
+        buf = ["event: avr_update\n"]
+        for line in state.json().split("\n"):
+            buf.append("data: %s\n" % (line))
+        buf.append("\n")
+        self.send("".join(buf).encode("utf-8"))
+
+
+def volume_ramp(av_loop, state, steps):
+    icons = bytes([0xc0, 0x00, 0x00, 0x00, 0xfd, 0xfb, 0x7a, 0x00, 0xc0]
+                  + [0x00] * 5)
+    for i in range(steps):
+        state.update(AVR_Status(
+            "DVD           ", "  VOL %3i dB  " % (-60 + i % 40), icons))
+
+
+def run(num_clients, steps, use_hub):
+    av_loop = Bench_Loop()
+    dev = av_loop.devices["avr"] = Bench_Device(av_loop, "avr")
+    # Most clients want everything, some only want volume and mute
+    clients = [Bench_Client() if i % 4 else Bench_Client(("mute", "volume"))
+               for i in range(num_clients)]
+    if use_hub:
+        hub = AV_EventHub(av_loop)
+        for client in clients:
+            hub.add_client(client)
+    else:
+        def emit_all(event):
+            for client in clients:
+                client.emit_avr_update(event.state)
+        av_loop.event_bus.subscribe(AVR_StateChanged, emit_all)
+
+    t = time.time()
+    volume_ramp(av_loop, dev.state, steps)
+    t = time.time() - t
+    return t / steps, sum(c.received for c in clients) / steps
+
+
+def main(args):
+    steps = int(args[0]) if args else 200
+    print("%8s %22s %22s" % ("clients", "per-client encoding", "event hub"))
+    for n in (10, 30, 100, 300):
+        old_t, old_b = run(n, steps, False)
+        hub_t, hub_b = run(n, steps, True)
+        print("%8u %10.1f us %7u B %10.1f us %7u B" % (
+            n, old_t * 1e6, old_b, hub_t * 1e6, hub_b))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
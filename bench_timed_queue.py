@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+Benchmark TimedQueue: the heap-based version vs. the old sorted list.
+
+Add a number of objects with random timeouts, then step a fake clock
+forward, polling current() after each step, until all objects have
+expired. Both queues are driven by the same fake clock, and must agree
+on the current object at every step.
+"""
+
+import sys
+import time
+import random
+
+from timed_queue import TimedQueue
+
+
+class Fake_Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Legacy_TimedQueue(object):
+    """TimedQueue before the heap, with time.time() replaced by clock()."""
+
+    def __init__(self, default=None, clock=time.time):
+        self.clock = clock
+        self.q = [(sys.maxsize, default)]
+
+    def current(self):
+        now = self.clock()
+        while self.q[0][0] < now:
+            assert len(self.q)
+            self.q.pop(0)
+        assert self.q[0][0] >= now
+        return self.q[0][1]
+
+    def add_absolute(self, timeout, obj):
+        assert timeout > self.clock()
+        i = 0
+        while self.q[i][0] <= timeout:
+            i += 1
+        self.q.insert(i, (timeout, obj))
+
+    def add_relative(self, rel_timeout, obj):
+        return self.add_absolute(self.clock() + rel_timeout, obj)
+
+
+def run(cls, n, steps, seed=0):
+    clock = Fake_Clock()
+    q = cls("default", clock=clock)
+    rnd = random.Random(seed)
+    timeouts = [rnd.uniform(0.001, 10.0) for _ in range(n)]
+
+    t = time.time()
+    for i, timeout in enumerate(timeouts):
+        q.add_relative(timeout, i)
+    add_t = time.time() - t
+
+    seen = []
+    t = time.time()
+    for _ in range(steps):
+        clock.now += 10.0 / steps
+        seen.append(q.current())
+    expire_t = time.time() - t
+    assert seen[-1] == "default"
+    return add_t / n, expire_t / steps, seen
+
+
+def main(args):
+    sizes = [int(arg) for arg in args] or [100, 1000, 10000]
+    steps = 1000
+    print("%8s %-10s %12s %14s" % (
+        "entries", "queue", "add", "current()"))
+    for n in sizes:
+        old_add, old_cur, old_seen = run(Legacy_TimedQueue, n, steps)
+        new_add, new_cur, new_seen = run(TimedQueue, n, steps)
+        assert old_seen == new_seen
+        print("%8u %-10s %9.2f us %11.2f us" % (
+            n, "list", old_add * 1e6, old_cur * 1e6))
+        print("%8u %-10s %9.2f us %11.2f us" % (
+            n, "heap", new_add * 1e6, new_cur * 1e6))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
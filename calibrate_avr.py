@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""
+Find the fastest rate at which the AVR reliably accepts commands.
+
+Write volume steps straight to the AVR (bypassing AVR_Device's write queue
+and pacing) at a series of decreasing intervals, and count how many steps
+are reflected in the volume reported by the AVR. Also measure the latency
+from each write to the resulting status change. AVR_Device's own writes
+(e.g. its volume display refreshes) are held meanwhile, so that they do
+not interfere with the measurements.
+
+Run against the real AVR, or against fake_avr.py (e.g. with --avr-min-gap
+to simulate an AVR that ignores commands arriving too quickly):
+
+    ./fake_avr.py --avr-min-gap 0.15
+    ./calibrate_avr.py --avr-tty /dev/pts/N
+
+The volume is stepped up and down alternately, so that it ends up close
+to where it started.
+"""
+
+import sys
+import argparse
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from av_loop import AV_Loop
+from avr_device import AVR_Device
+from avr_state import AVR_StateChanged
+
+
+DefaultGaps = (1.0, 0.5, 0.3, 0.2, 0.15, 0.1, 0.07, 0.05)
+
+Settle = 1.5  # seconds to wait for the AVR to catch up after each run
+
+
+class Latency_Probe(object):
+    """Measure the time from each write to the next volume change."""
+
+    def __init__(self, av_loop):
+        self.av_loop = av_loop
+        self.written_at = None
+        self.samples = []
+        av_loop.event_bus.subscribe(
+            AVR_StateChanged, self.handle_change,
+            lambda event: "volume" in event.changed)
+
+    def wrote(self):
+        self.written_at = self.av_loop.time()
+
+    def handle_change(self, event):
+        if self.written_at is not None:
+            self.samples.append(self.av_loop.time() - self.written_at)
+            self.written_at = None
+
+    def median(self):
+        if not self.samples:
+            return None
+        return sorted(self.samples)[len(self.samples) // 2]
+
+
+@gen.coroutine
+def calibrate(avr, probe, gaps, steps):
+    # Wait for the AVR to report its volume. As AVR_Device's writes are
+    # held, we must wake the AVR and trigger its volume display ourselves.
+    deadline = avr.av_loop.time() + 10
+    while avr.state.off is not False or avr.state.volume is None:
+        if avr.av_loop.time() > deadline:
+            raise RuntimeError("No volume reported by the AVR. Is it on?")
+        if avr.state.off is False and avr.state.standby:
+            avr.ser.write(avr.Codec.encode("POWER ON"))
+            yield gen.sleep(Settle)
+        elif avr.state.off is False and not avr.state.mute:
+            avr.ser.write(avr.Codec.encode("VOL UP"))  # Shows volume only
+            yield gen.sleep(Settle)
+        else:  # No status yet (or muted)
+            yield gen.sleep(0.1)
+
+    best = None
+    print("%8s %6s %6s %12s" % ("gap", "steps", "lost", "latency"))
+    for i, gap in enumerate(gaps):
+        keyword = "VOL UP" if i % 2 == 0 else "VOL DOWN"
+        frame = avr.Codec.encode(keyword)
+        if not avr.state.showing_volume:  # Wake up the volume display
+            avr.ser.write(frame)
+            yield gen.sleep(Settle)
+
+        start_volume = avr.state.volume
+        probe.samples = []
+        for _ in range(steps):
+            probe.wrote()
+            avr.ser.write(frame)
+            yield gen.sleep(gap)
+        yield gen.sleep(Settle)
+
+        lost = steps - abs(avr.state.volume - start_volume)
+        latency = probe.median()
+        print("%6.3f s %6u %6u %9s" % (
+            gap, steps, lost,
+            "-" if latency is None else "%6.3f s" % (latency)))
+        if lost == 0:
+            best = (gap, latency)
+
+    if best is None:
+        print("The AVR lost commands at every tested rate.")
+    else:
+        gap, latency = best
+        print("Fastest safe rate: %.1f commands/s (one per %.3f s)." % (
+            1 / gap, gap))
+        if latency is not None:
+            print("Median write->status latency: %.3f s" % (latency))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="Calibrate write pacing for " + AVR_Device.Description)
+    AVR_Device.register_args("avr", parser)
+    parser.add_argument(
+        "--steps", type=int, default=10,
+        help="Number of volume steps per tested rate (default: %(default)s)")
+    parser.add_argument(
+        "--gaps", type=float, nargs="+", default=DefaultGaps,
+        metavar="SECS",
+        help="Intervals between volume steps to test, from slowest to"
+             " fastest (default: %(default)s)")
+    parsed = parser.parse_args(args)
+
+    IOLoop.configure(AV_Loop, parsed_args=vars(parsed))
+    mainloop = IOLoop.instance()
+    avr = AVR_Device(mainloop, "avr")
+    avr.hold_writes(True)
+    probe = Latency_Probe(mainloop)
+
+    try:
+        mainloop.run_sync(
+            lambda: calibrate(avr, probe, parsed.gaps, parsed.steps),
+            timeout=(sum(parsed.gaps) + 2 * Settle) * parsed.steps * 2 + 10)
+    except KeyboardInterrupt:
+        print("Aborted by Ctrl-C")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
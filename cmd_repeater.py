@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+from av_device import AV_Device
+from av_completion import AV_Completion
+
+
+class AV_RepeatSession(object):
+    """An A/V command that is repeated until stopped."""
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.completion = None  # AV_Completion of the current repetition
+        self.expiry = None  # Timeout handle for max duration
+        self.repeats = 0
+
+    def __str__(self):
+        return "<%s '%s' x%u>" % (
+            self.__class__.__name__, self.cmd, self.repeats)
+
+
+class AV_CommandRepeater(AV_Device):
+    """Repeat A/V commands on behalf of clients, e.g. while a key is held.
+
+    "repeat start <cmd>" starts submitting <cmd> repeatedly, and
+    "repeat stop <cmd>" stops it again ("repeat stop" stops all repeating
+    commands). Each repetition is submitted only once the previous one
+    has been written to its device, so the commands are repeated at the
+    rate at which the device actually accepts them, and the device write
+    queue never holds more than one repetition. On stop, that queued
+    repetition is discarded, so that the command stops taking effect
+    immediately.
+
+    As a safety net against lost stop commands, each session is stopped
+    after a maximum duration.
+
+    Must be created after the devices whose commands are to be repeated.
+    If those have registered no commands, there is nothing to repeat,
+    and creation fails, instead of registering the only commands there
+    are.
+    """
+
+    Description = "A/V command auto-repeat"
+
+    DefaultMaxDuration = 10.0  # seconds
+
+    @classmethod
+    def register_args(cls, name, arg_parser):
+        arg_parser.add_argument(
+            "--%s-max-duration" % (name), type=float,
+            default=cls.DefaultMaxDuration, metavar="SECS",
+            help="Stop repeating commands after SECS, if not stopped by"
+                 " the client (default: %(default)s)")
+
+    def __init__(self, av_loop, name):
+        AV_Device.__init__(self, av_loop, name)
+        if not av_loop.cmd_router:
+            raise RuntimeError("No A/V commands to repeat")
+
+        self.max_duration = av_loop.args["%s_max_duration" % (name)]
+        self.sessions = {}  # Map A/V command to AV_RepeatSession
+        self.stats = {"sessions": 0, "repeats": 0, "discarded": 0,
+                      "expired": 0, "failed": 0}
+
+        self.av_loop.add_cmd_handler(
+            "%s start" % (self.name), self.handle_start)
+        self.av_loop.add_cmd_handler(
+            "%s stop" % (self.name), self.handle_stop)
+
+    def diagnostics(self):
+        ret = dict(self.stats)
+        ret["active"] = sorted(self.sessions)
+        return ret
+
+    def handle_start(self, cmd, rest):
+        rest = " ".join(rest.split())
+        if not rest:
+            raise ValueError("Missing command for '%s'" % (cmd))
+        if rest.split()[0] == self.name:
+            raise ValueError("Cannot repeat '%s'" % (rest))
+        if rest in self.sessions:  # Already repeating
+            return
+        session = AV_RepeatSession(rest)
+        self.sessions[rest] = session
+        self.stats["sessions"] += 1
+        session.expiry = self.av_loop.add_timeout(
+            self.av_loop.time() + self.max_duration,
+            lambda: self.expire(session))
+        self.debug("Started repeating '%s'" % (rest))
+        self.repeat(session)
+
+    def handle_stop(self, cmd, rest):
+        rest = " ".join(rest.split())
+        if rest:
+            session = self.sessions.get(rest)
+            if session is not None:
+                self.stop(session)
+        else:
+            for session in list(self.sessions.values()):
+                self.stop(session)
+
+    def repeat(self, session):
+        """Submit the next repetition of the given session's command."""
+        session.completion = AV_Completion(session.cmd, "written")
+        self.av_loop.add_future(
+            self.av_loop.dispatch(session.completion, self.max_duration),
+            lambda future: self.repeated(session, future))
+
+    def repeated(self, session, future):
+        if self.sessions.get(session.cmd) is not session:
+            return  # Stopped in the meantime
+        try:
+            stage = future.result()
+        except Exception as e:
+            self.debug("Stopped repeating '%s': %s" % (session.cmd, e))
+            self.stats["failed"] += 1
+            self.stop(session)
+            return
+        if stage != "written":  # Had no effect, e.g. no writes
+            self.debug("Stopped repeating '%s': Reached only %s" % (
+                session.cmd, stage))
+            self.stop(session)
+            return
+        session.repeats += 1
+        self.stats["repeats"] += 1
+        self.repeat(session)
+
+    def expire(self, session):
+        session.expiry = None
+        self.stats["expired"] += 1
+        self.debug("Max duration of %s expired" % (session))
+        self.stop(session)
+
+    def stop(self, session):
+        """Stop the given session, and discard its queued repetition."""
+        if self.sessions.get(session.cmd) is not session:
+            return
+        del self.sessions[session.cmd]
+        if session.expiry is not None:
+            self.av_loop.remove_timeout(session.expiry)
+            session.expiry = None
+        completion = session.completion
+        if completion is not None and not completion.done():
+            self.stats["discarded"] += 1
+            self.av_loop.discard(completion)
+        self.debug("Stopped %s" % (session))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+
+class AV_CommandRouter(object):
+    """Map A/V commands to the handlers registered for their longest prefix.
+
+    The longest registered prefix of a command is found by dropping words
+    from the end of the command until it matches a registered command.
+    See AV_Loop.add_cmd_handler() for the matching rules.
+
+    The result of each lookup is cached by the (unsplit) command string,
+    as a small number of commands (e.g. "avr vol+") make up the majority
+    of the traffic. The cache is flushed whenever handlers are added or
+    removed.
+
+    Handlers are kept in tuples that are replaced (never modified) when
+    handlers are added or removed, so handlers may safely add or remove
+    handlers while a command is being dispatched. Such changes take effect
+    from the next dispatched command.
+    """
+
+    MaxCached = 1024  # Max number of cached lookups
+
+    def __init__(self):
+        self.handlers = {}  # Map registered command to tuple of handlers
+        self.cache = {}  # Map command string to lookup() result
+
+    def __len__(self):
+        return len(self.handlers)
+
+    def add(self, cmd, handler):
+        """Register the given handler to receive the given A/V command."""
+        cmd = " ".join(cmd.split())
+        self.handlers[cmd] = self.handlers.get(cmd, ()) + (handler,)
+        self.cache.clear()
+
+    def remove(self, cmd, handler):
+        """Remove the given handler for the given A/V command.
+
+        Unknown commands and handlers are silently ignored.
+        """
+        cmd = " ".join(cmd.split())
+        handlers = list(self.handlers.get(cmd, ()))
+        if handler not in handlers:
+            return
+        handlers.remove(handler)
+        if handlers:
+            self.handlers[cmd] = tuple(handlers)
+        else:
+            del self.handlers[cmd]
+        self.cache.clear()
+
+    def lookup(self, cmd):
+        """Find the handlers for the given A/V command.
+
+        Return a (matched_cmd, rest, handlers) tuple, where matched_cmd
+        is the longest registered prefix of the given command, rest is
+        the remainder of the command, and handlers is a tuple of the
+        handlers registered for matched_cmd. If there is no match (not
+        even a catch-all handler), matched_cmd is None, and handlers is
+        empty.
+        """
+        ret = self.cache.get(cmd)
+        if ret is None:
+            ret = self.match(cmd)
+            if len(self.cache) >= self.MaxCached:
+                self.cache.clear()
+            self.cache[cmd] = ret
+        return ret
+
+    def match(self, cmd):
+        """Like lookup(), but bypassing the cache."""
+        words = cmd.split()
+        for i in range(len(words), -1, -1):
+            prefix = " ".join(words[:i])
+            handlers = self.handlers.get(prefix)
+            if handlers is not None:
+                return (prefix, " ".join(words[i:]), handlers)
+        return (None, " ".join(words), ())
+
+    def dispatch(self, cmd):
+        """Invoke the handlers matching the given A/V command.
+
+        Return the registered command that matched, or None if there
+        were no matching handlers.
+        """
+        matched, rest, handlers = self.lookup(cmd)
+        for handler in handlers:
+            handler(matched, rest)
+        return matched
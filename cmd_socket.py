@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import stat
+import errno
+import socket
+
+from av_device import AV_Device
+
+
+class AV_CommandSocket(AV_Device):
+    """Receive A/V commands on a local Unix datagram socket and over UDP.
+
+    This is a lightweight alternative to submitting commands through the
+    HTTP server, e.g. for clients running on the same host. Each datagram
+    carries one or more newline-separated A/V commands, which are passed
+    straight to AV_Loop.submit_cmd(). Nothing is sent in reply.
+
+    From a shell, commands may be sent with e.g.:
+
+        echo "avr vol+" | socat - UNIX-SENDTO:/tmp/av_control.sock
+        printf "hdmi 2\\navr on\\n" | socat - UDP-SENDTO:localhost:8001
+    """
+
+    Description = "A/V command socket"
+
+    DefaultSocketPath = "/tmp/av_control.sock"
+
+    DefaultListenHost = "127.0.0.1"
+    DefaultListenPort = 8001
+
+    MaxDatagram = 64 * 1024
+
+    @classmethod
+    def register_args(cls, name, arg_parser):
+        arg_parser.add_argument(
+            "--%s-path" % (name),
+            default=cls.DefaultSocketPath, metavar="PATH",
+            help="Unix socket path for %s, or empty to disable"
+                 " (default: %%(default)s)" % (cls.Description))
+        arg_parser.add_argument(
+            "--%s-host" % (name),
+            default=cls.DefaultListenHost, metavar="HOST",
+            help="Listening UDP hostname or IP address for %s"
+                 " (default: %%(default)s)" % (cls.Description))
+        arg_parser.add_argument(
+            "--%s-port" % (name), type=int,
+            default=cls.DefaultListenPort, metavar="PORT",
+            help="Listening UDP port number for %s, or 0 to disable"
+                 " (default: %%(default)s)" % (cls.Description))
+
+    def __init__(self, av_loop, name):
+        AV_Device.__init__(self, av_loop, name)
+
+        self.socks = {}  # Map file descriptors to listening sockets
+        self.stats = {"datagrams": 0, "cmds": 0, "errors": 0}
+
+        self.path = av_loop.args["%s_path" % (self.name)]
+        host = av_loop.args["%s_host" % (self.name)]
+        port = av_loop.args["%s_port" % (self.name)]
+
+        # Bind all sockets before listening on any of them, so that we
+        # leave nothing behind if one of them fails
+        socks = []
+        bound_path = False
+        try:
+            if self.path:
+                if os.path.exists(self.path):
+                    self.remove_stale(self.path)
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                socks.append(sock)
+                sock.bind(self.path)
+                bound_path = True
+            if port:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                socks.append(sock)
+                sock.bind((host, port))
+        except Exception:
+            for sock in socks:
+                sock.close()
+            if bound_path:
+                os.unlink(self.path)
+            raise
+        for sock in socks:
+            self.listen(sock)
+
+        if not self.socks:
+            raise ValueError("No socket path or UDP port given")
+
+    @staticmethod
+    def remove_stale(path):
+        """Remove the socket at the given path, left over from a past run.
+
+        Fail if the path is not a socket, or if another process is still
+        listening on it (i.e. anything but ECONNREFUSED on connect).
+        """
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            raise ValueError("%s exists, and is not a socket" % (path))
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            probe.connect(path)
+        except socket.error as e:
+            if e.args[0] != errno.ECONNREFUSED:
+                raise
+            os.unlink(path)  # Nobody listening
+            return
+        finally:
+            probe.close()
+        raise socket.error(
+            errno.EADDRINUSE, "Socket in use by another process", path)
+
+    def listen(self, sock):
+        sock.setblocking(False)
+        self.socks[sock.fileno()] = sock
+        self.av_loop.add_handler(
+            sock.fileno(), self.handle_io, self.av_loop.READ)
+
+    def close(self):
+        for fd, sock in self.socks.items():
+            self.av_loop.remove_handler(fd)
+            sock.close()
+        self.socks = {}
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def handle_io(self, fd, events):
+        assert events & self.av_loop.READ
+        sock = self.socks[fd]
+        while True:  # Drain all pending datagrams
+            try:
+                data = sock.recv(self.MaxDatagram)
+            except socket.error as e:
+                if e.args[0] in (errno.EWOULDBLOCK, errno.EAGAIN):
+                    return
+                raise
+            self.stats["datagrams"] += 1
+            self.handle_datagram(data)
+
+    def handle_datagram(self, data):
+        try:
+            cmds = data.decode("utf-8")
+        except UnicodeDecodeError:
+            self.stats["errors"] += 1
+            self.debug("Discarding undecodable datagram %r" % (data))
+            return
+        for cmd in cmds.split("\n"):
+            cmd = cmd.strip()
+            if cmd:
+                self.debug("Received cmd '%s'" % (cmd))
+                self.stats["cmds"] += 1
+                try:
+                    self.av_loop.submit_cmd(cmd)
+                except Exception as e:  # Don't let one cmd drop the rest
+                    self.stats["errors"] += 1
+                    self.debug("Failed cmd '%s': %r" % (cmd, e))
+
+    def diagnostics(self):
+        return dict(self.stats)
+
+
+def main(args):
+    import argparse
+    from tornado.ioloop import IOLoop
+
+    from av_loop import AV_Loop
+
+    parser = argparse.ArgumentParser(description=AV_CommandSocket.Description)
+    AV_CommandSocket.register_args("sock", parser)
+
+    IOLoop.configure(AV_Loop, parsed_args=vars(parser.parse_args(args)))
+    mainloop = IOLoop.instance()
+    sock = AV_CommandSocket(mainloop, "sock")
+    mainloop.add_device("sock", sock)
+
+    def cmd_catch_all(empty, cmd):
+        assert empty == ""
+        print(" -> Received cmd '%s'" % (cmd))
+    mainloop.add_cmd_handler("", cmd_catch_all)
+
+    print("Listening for A/V commands on %s (Ctrl-C to stop me)" % (
+        ", ".join(str(s.getsockname()) for s in sock.socks.values())))
+    return mainloop.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
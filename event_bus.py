@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+
+class AV_EventBus(object):
+    """Deliver typed events from publishers to interested subscribers.
+
+    Unlike A/V commands (see AV_Loop.submit_cmd()), events are objects,
+    typically namedtuples, that carry their payload with them. The type
+    of an event is its topic: subscribers register for an event type, and
+    publishing an event only visits the subscribers of that type. Each
+    subscriber may also supply a filter predicate, and is then only
+    invoked for events for which filter(event) is true.
+
+    As with AV_CommandRouter, subscribers are kept in tuples that are
+    replaced (never modified), so subscribers may safely subscribe or
+    unsubscribe while an event is being published.
+    """
+
+    def __init__(self):
+        self.subscribers = {}  # Map event type to (handler, filter) tuple
+
+    def subscribe(self, topic, handler, filter=None):
+        """Invoke handler(event) for each published event of type topic.
+
+        If filter is given, handler is only invoked for the events where
+        filter(event) returns true.
+        """
+        self.subscribers[topic] = \
+            self.subscribers.get(topic, ()) + ((handler, filter),)
+
+    def unsubscribe(self, topic, handler):
+        """Remove the given handler's subscription(s) to the given topic."""
+        subs = tuple(
+            s for s in self.subscribers.get(topic, ()) if s[0] != handler)
+        if subs:
+            self.subscribers[topic] = subs
+        else:
+            self.subscribers.pop(topic, None)
+
+    def publish(self, event):
+        """Deliver the given event to the subscribers of its type."""
+        for handler, filter in self.subscribers.get(type(event), ()):
+            if filter is None or filter(event):
+                handler(event)
@@ -1,14 +1,15 @@
 #!/usr/bin/env python
 
 import os
-import time
+import errno
 from tornado.ioloop import PeriodicCallback
 
 from fake_serial_device import Fake_SerialDevice
 from timed_queue import TimedQueue
 from avr_dgram import AVR_Datagram
+from av_framer import AV_Framer
 from avr_status import AVR_Status
-from avr_command import AVR_Command
+from avr_command import AVR_Command, AVR_CommandCodec
 
 
 class Fake_AVR(Fake_SerialDevice):
@@ -34,6 +35,19 @@ class Fake_AVR(Fake_SerialDevice):
     RecvDGramSpec = (b"PCSEND", 2, 4)  # Receive PC->AVR remote commands
     SendDGramSpec = (b"MPSEND", 3, 48)  # Send AVR->PC status updates
 
+    Codec = AVR_CommandCodec(RecvDGramSpec)
+
+    DefaultMinGap = 0.0  # Accept commands at any rate
+
+    @classmethod
+    def register_args(cls, name, arg_parser):
+        arg_parser.add_argument(
+            "--%s-min-gap" % (name), type=float,
+            default=cls.DefaultMinGap, metavar="SECS",
+            help="Ignore commands arriving less than SECS after the"
+                 " previous accepted command, like a real AVR would"
+                 " (default: %%(default)s)")
+
     def __init__(self, av_loop, name):
         Fake_SerialDevice.__init__(self, av_loop, name)
 
@@ -41,34 +55,60 @@ class Fake_AVR(Fake_SerialDevice):
         self.mute = False
         self.volume = -35  # dB
 
-        self.status_queue = TimedQueue(self.gen_status("standby"))
+        # Send the new status as soon as a temporary status expires
+        self.status_queue = TimedQueue(
+            self.gen_status("standby"), av_loop,
+            lambda status: self.write_now())
+        self.sent_status = None  # Status last built into self.sent_dgram
+        self.sent_dgram = None
 
         self.write_timer = PeriodicCallback(self.write_now, 50, av_loop)
         self.write_timer.start()
 
-        self.recv_dgram_len = AVR_Datagram.full_dgram_len(self.RecvDGramSpec)
-        self.recv_data = ""  # Receive buffer
+        self.framer = AV_Framer(self.RecvDGramSpec)
 
-        self.t0 = time.time()
+        self.min_gap = av_loop.args["%s_min_gap" % (name)]
+        self.last_cmd = 0  # Time of last accepted command
+
+        self.t0 = av_loop.time()
+        self.stats = {"ticks": 0, "skipped_ticks": 0}
 
     def __del__(self):
         self.write_timer.stop()
 
+    def diagnostics(self):
+        ret = {"framing": self.framer.diagnostics()}
+        ret.update(self.stats)
+        return ret
+
     def write_now(self):
-        os.write(self.master, AVR_Datagram.build_dgram(
-            self.status().dgram(), self.SendDGramSpec))
+        status = self.status()
+        if status is not self.sent_status:  # Rebuild only when changed
+            self.sent_status = status
+            self.sent_dgram = AVR_Datagram.build_dgram(
+                status.dgram(), self.SendDGramSpec)
+        self.stats["ticks"] += 1
+        try:
+            os.write(self.master, self.sent_dgram)
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+            # The client is not keeping up. Like the real AVR, we don't
+            # buffer status updates for it, but skip this one.
+            self.stats["skipped_ticks"] += 1
 
     def status(self):
         """Return AVR_Status diagram for current state."""
         return self.status_queue.current()
 
     def handle_read(self):
-        self.recv_data += os.read(self.master, 1024)
-        while len(self.recv_data) >= self.recv_dgram_len:
-            dgram = self.recv_data[:self.recv_dgram_len]
-            self.recv_data = self.recv_data[self.recv_dgram_len:]
-            self.handle_command(AVR_Command.from_dgram(
-                AVR_Datagram.parse_dgram(dgram, self.RecvDGramSpec)))
+        while self.framer.fill_from_fd(self.master):
+            for dgram in self.framer.frames():
+                keyword = self.Codec.decode(dgram)
+                if keyword is None:  # Unknown command
+                    self.framer.record_bad("bad_payload", dgram)
+                    continue
+                self.handle_command(AVR_Command(keyword))
 
     def gen_status(self, key):
         line1, line2, icons = self.StatusMap[key]
@@ -76,8 +116,12 @@ class Fake_AVR(Fake_SerialDevice):
         return AVR_Status(line1 % d, line2 % d, icons)
 
     def handle_command(self, cmd):
-        now = time.time()
+        now = self.av_loop.time()
         print("%7.2f: %10s" % (now - self.t0, cmd.keyword), end=' ')
+        if now - self.last_cmd < self.min_gap:
+            print("-> ignored (too soon)")
+            return
+        self.last_cmd = now
         if self.standby:
             if cmd.keyword == "POWER ON":
                 self.standby = False
@@ -91,7 +135,9 @@ class Fake_AVR(Fake_SerialDevice):
                 self.status_queue.flush(
                     self.gen_status(self.mute and "mute" or "default"))
             elif cmd.keyword == "VOL DOWN" or cmd.keyword == "VOL UP":
+                lo, hi = AVR_Status.VolumeRange
                 self.volume += cmd.keyword == "VOL DOWN" and -1 or +1
+                self.volume = max(lo, min(hi, self.volume))
                 self.status_queue.flush(self.gen_status("default"))
                 self.status_queue.add_relative(3, self.gen_status("volume"))
         print("->", self.status())
@@ -52,9 +52,10 @@ class HDMI_Switch(AV_SerialDevice):
         elif s == b"\0":
             self.ready_to_write(False)
             self.debug("stopped.")
-        elif s.strip() in ("1", "2", "3", "4", "5", "v", "?"):
+        elif s.strip() in (b"1", b"2", b"3", b"4", b"5", b"v", b"?"):
             self.debug("Executed command '%s'" % (
                 str(s.strip(), 'ascii')))
+            self.confirm_writes()
         elif s != b">":
             self.debug("Unrecognized input: '%s'" % (
                 self.human_readable(s)))
@@ -70,7 +71,7 @@ class HDMI_Switch(AV_SerialDevice):
         cmd = cmd.split()
         assert cmd[0] == self.name
         assert len(cmd) == 2
-        self.schedule_write(self.Commands[cmd[1]])
+        self.schedule_write(self.Commands[cmd[1]], self.av_loop.completion)
 
 
 def main(args):
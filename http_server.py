@@ -1,69 +1,483 @@
 #!/usr/bin/env python
 
-import time
+import json
+import socket
+import tornado.gen
 import tornado.web
+import tornado.ioloop
+import tornado.iostream
+import tornado.websocket
 
 from av_device import AV_Device
+from av_completion import AV_Completion
+from avr_state import AVR_State, AVR_StateChanged
+
+
+def stream_buffered(stream):
+    """Return #bytes buffered in the given IOStream, and not yet sent.
+
+    There is no public API for this, so peek at the IOStream internals.
+    check_stream_buffered() verifies at startup that this still works.
+    """
+    return stream._write_buffer_size
+
+
+def check_stream_buffered():
+    """Fail unless stream_buffered() works with this Tornado version."""
+    a, b = socket.socketpair()
+    try:
+        stream = tornado.iostream.IOStream(a)
+        if not isinstance(getattr(stream, "_write_buffer_size", None), int):
+            raise RuntimeError(
+                "IOStream._write_buffer_size is missing in Tornado %s;"
+                " cannot detect slow /events clients" % (tornado.version))
+        stream.close()
+    finally:
+        a.close()
+        b.close()
+
+
+class AV_EventHub(object):
+    """Broadcast AVR state changes to all connected /events clients.
+
+    Instead of having each client serialize the AVR state on its own,
+    the hub encodes each state version once (per distinct set of fields
+    requested by the clients, and per client format) into ready-to-send
+    buffers, and hands the same buffer to every client that wants it.
+
+    The hub also owns a single heartbeat timer for all clients, so that
+    they can detect disconnection even if their browser (e.g. Opera)
+    does not. Clients that received a real event so recently that they
+    will hear from us again before ClientTimeout are skipped, and clients
+    found to be disconnected are dropped in bulk.
+
+    Slow clients (e.g. phones on bad Wi-Fi) are not allowed to buffer
+    more than MaxBuffered bytes of output. Beyond that, events to the
+    client are held back (heartbeats are simply dropped), and once the
+    client's buffer has drained, a snapshot of the newest state is sent
+    in place of all the events that were held back. Clients that stay
+    stuck for more than MaxStuck seconds are disconnected.
+
+    Clients must have a 'fields' attribute (a tuple of AVR_State.Fields),
+    a 'Format' attribute (see encode()) and the following methods:
+     - send(buf): Write the given bytes to the client.
+     - buffered(): Return #bytes buffered and not yet sent to client.
+     - closed(): Return True if the client has disconnected.
+     - disconnect(): Close the connection to the client.
+    """
+
+    HeartbeatInterval = 3.0  # seconds
+
+    ClientTimeout = 5.0  # seconds of silence before clients reconnect
+
+    MaxBuffered = 64 * 1024  # bytes
+
+    MaxStuck = 30.0  # seconds
+
+    def __init__(self, av_loop):
+        self.av_loop = av_loop
+        self.clients = {}  # Map (fields, format) -> set of clients
+        self.snapshots = {}  # Map (fields, format) -> (version, buffer)
+        self.last_sent = {}  # Map client -> timestamp of last event
+        self.stuck = {}  # Map client -> timestamp of first held-back event
+        self.stats = {"encoded": 0, "sent": 0, "heartbeats": 0,
+                      "held_back": 0, "dropped": 0}
+
+        self.heartbeat = tornado.ioloop.PeriodicCallback(
+            self.emit_heartbeat, self.HeartbeatInterval * 1000, av_loop)
+
+        self.av_loop.event_bus.subscribe(
+            AVR_StateChanged, self.handle_avr_update,
+            lambda event: event.name == "avr")
+
+    @staticmethod
+    def encode(fmt, event, data):
+        """Return the given event and JSON data in the given format.
+
+        The "sse" format yields server-sent event bytes, while the "ws"
+        format yields a JSON text message with "event" and "data" keys.
+        """
+        if fmt == "ws":
+            return json.dumps({"event": event, "data": data})
+        lines = ["event: %s" % (event)]
+        for line in json.dumps(data).split("\n"):
+            lines.append("data: %s" % (line))
+        return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+    def avr_state(self):
+        try:
+            return self.av_loop.devices["avr"].state
+        except KeyError:
+            return None
+
+    def snapshot(self, fields, fmt):
+        """Return an "avr_state" event with the given fields."""
+        state = self.avr_state()
+        version = state and state.version
+        cached = self.snapshots.get((fields, fmt))
+        if cached and cached[0] == version:
+            return cached[1]
+
+        if state is None:
+            buf = self.encode(fmt, "avr_state", None)
+        else:
+            buf = self.encode(fmt, "avr_state", {
+                "version": version,
+                "state": state.as_dict(fields),
+            })
+        self.stats["encoded"] += 1
+        self.snapshots[(fields, fmt)] = (version, buf)
+        return buf
+
+    def add_client(self, client):
+        """Send the current state to the client, and add it to the hub."""
+        if not self.heartbeat.is_running():
+            self.heartbeat.start()
+        key = (client.fields, client.Format)
+        self.clients.setdefault(key, set()).add(client)
+        # Track the client even if its snapshot is held back by send(),
+        # so that heartbeats retry it (or drop it after MaxStuck)
+        now = self.av_loop.time()
+        self.last_sent[client] = now
+        if not self.send(client, self.snapshot(*key), now):
+            self.drop_clients([client])
+
+    def remove_client(self, client):
+        key = (client.fields, client.Format)
+        clients = self.clients.get(key)
+        if clients is not None:
+            clients.discard(client)
+            if not clients:
+                del self.clients[key]
+                self.snapshots.pop(key, None)
+        self.last_sent.pop(client, None)
+        self.stuck.pop(client, None)
+        if not self.clients and self.heartbeat.is_running():
+            self.heartbeat.stop()
+
+    def send(self, client, buf, now):
+        """Send the given buffer to the given client.
+
+        Hold back the buffer if the client already has too much output
+        buffered. When a client that has had events held back is ready
+        again, send it a fresh snapshot instead of the given buffer.
+
+        Return False if the client has disconnected, or has been stuck
+        for too long, and should be dropped.
+        """
+        if client.closed():
+            return False
+        if client.buffered() > self.MaxBuffered:
+            since = self.stuck.setdefault(client, now)
+            self.stats["held_back"] += 1
+            return now - since <= self.MaxStuck
+        if client in self.stuck:
+            del self.stuck[client]
+            buf = self.snapshot(client.fields, client.Format)
+        client.send(buf)
+        self.last_sent[client] = now
+        self.stats["sent"] += 1
+        return True
+
+    def drop_clients(self, clients):
+        """Remove and disconnect the given clients."""
+        for client in clients:
+            self.remove_client(client)
+            client.disconnect()
+        self.stats["dropped"] += len(clients)
+
+    def diagnostics(self):
+        clients = []
+        for client, last in self.last_sent.items():
+            clients.append({
+                "client": str(client),
+                "fields": client.fields,
+                "buffered": client.buffered(),
+                "stuck": client in self.stuck,
+            })
+        return {"clients": clients, "stats": self.stats}
+
+    def emit_heartbeat(self):
+        now = self.av_loop.time()
+        bufs = {}  # Map format -> heartbeat event
+        for fmt in set(fmt for fields, fmt in self.clients):
+            bufs[fmt] = self.encode(fmt, "heartbeat", int(now))
+        # Skip clients whose last event is so recent that the next
+        # heartbeat still reaches them within ClientTimeout of it.
+        # Stuck clients are never skipped, as this is where we notice
+        # that their buffer has drained (or that they've been stuck
+        # for too long).
+        since = now - (self.ClientTimeout - self.HeartbeatInterval)
+        dead = [client for client, last in list(self.last_sent.items())
+                if (last <= since or client in self.stuck)
+                and not self.send(client, bufs[client.Format], now)]
+        self.stats["heartbeats"] += 1
+        if dead:
+            self.drop_clients(dead)
+
+    def handle_avr_update(self, event):
+        now = self.av_loop.time()
+        changed, state = event.changed, event.state
+        dead = []
+        patches = {}  # Map (patched fields, format) -> "avr_patch" event
+        for (fields, fmt), clients in list(self.clients.items()):
+            patched = tuple(f for f in fields if f in changed)
+            if not patched:
+                continue  # Nothing that these clients care about
+            key = (patched, fmt)
+            buf = patches.get(key)
+            if buf is None:
+                buf = patches[key] = self.encode(fmt, "avr_patch", {
+                    "version": state.version,
+                    "changes": state.as_dict(patched),
+                })
+                self.stats["encoded"] += 1
+            for client in list(clients):
+                if not self.send(client, buf, now):
+                    dead.append(client)
+        if dead:
+            self.drop_clients(dead)
+
+
+def requested_fields(handler):
+    """Return the AVR_State.Fields requested by the given handler.
+
+    Clients may pass a comma-separated list of fields in the "fields"
+    query argument. Otherwise, all fields are returned.
+    """
+    fields = handler.get_argument("fields", None)
+    if fields is None:
+        return AVR_State.Fields
+    fields = set(fields.split(","))
+    unknown = fields - set(AVR_State.Fields)
+    if unknown:
+        raise tornado.web.HTTPError(
+            400, "Unknown fields: %s" % (", ".join(unknown)))
+    return tuple(f for f in AVR_State.Fields if f in fields)
+
+
+def submit_cmd_result(av_loop, cmd):
+    """Submit the given A/V command and describe the outcome as a dict.
+
+    The returned dict contains the submitted "cmd", and whether it was
+    "accepted" (i.e. submitted without error). Accepted commands also
+    include the registered "handler" command that matched, and whether
+    that was a specific handler ("matched") or merely the catch-all.
+    Rejected commands include an "error" message instead.
+    """
+    result = {"cmd": cmd}
+    try:
+        handler = av_loop.submit_cmd(cmd)
+    except Exception as e:
+        result.update(
+            accepted=False, error="%s: %s" % (e.__class__.__name__, e))
+    else:
+        if handler is None:
+            result.update(accepted=False, error="No handler for command")
+            return result
+        result.update(accepted=True, handler=handler, matched=bool(handler))
+    return result
 
 
 class EventHandler(tornado.web.RequestHandler):
+    """Stream AVR state changes to the client as server-sent events.
+
+    On connect, the client receives an "avr_state" event containing the
+    current state version and the full AVR state document. Subsequent
+    changes are sent as "avr_patch" events containing the new version
+    and only the keys that changed. Clients may pass a comma-separated
+    list of AVR_State.Fields (e.g. "/events?fields=volume,mute") to only
+    receive (and be woken up by) changes to those fields.
+
+    The events themselves are encoded and broadcast by AV_EventHub.
+    """
+
+    Format = "sse"
 
     def initialize(self):
-        self.application.av_loop.add_cmd_handler(
-            "avr update", self.emit_avr_update)
-        self.heartbeat = None
+        self.fields = AVR_State.Fields  # Fields we send to the client
 
     def on_connection_close(self):
-        self.application.av_loop.remove_cmd_handler(
-            "avr update", self.emit_avr_update)
-        if self.heartbeat:
-            self.heartbeat.stop()
-            self.heartbeat = None
+        self.application.event_hub.remove_client(self)
 
     def prepare(self):
+        self.fields = requested_fields(self)
         self.set_header('Content-Type', 'text/event-stream')
         self.set_header('Cache-Control', 'no-cache')
         # Instruct clients to reconnect if they lose the connection
         self.write("retry: 3000\n")
-        # Also send a periodic heartbeat to the client, so they can
-        # detect disconnection even if their browser (e.g. Opera)
-        # does not.
-        self.heartbeat = tornado.ioloop.PeriodicCallback(
-            self.emit_heartbeat, 3000)
-        self.heartbeat.start()
 
-    def emit_heartbeat(self):
-        self.write("event: heartbeat\n")
-        self.write("data: %u\n\n" % (time.time()))
+    def send(self, buf):
+        self.write(buf)
         self.flush()
 
-    def emit_avr_update(self, *args):
-        self.write("event: avr_update\n")
-        try:
-            state = self.application.av_loop.devices["avr"].state
-            for line in state.json().split("\n"):
-                self.write("data: %s\n" % (line))
-        except:
-            self.write("data: 'null'\n")  # None in JSON
+    def buffered(self):
+        return stream_buffered(self.request.connection.stream)
 
-        self.write("\n")
-        self.flush()
+    def closed(self):
+        return self.request.connection.stream.closed()
+
+    def disconnect(self):
+        self.request.connection.stream.close()
+
+    def __str__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.request.remote_ip)
 
     @tornado.web.asynchronous
     def get(self):
-        pass
+        self.application.event_hub.add_client(self)
+
+
+class AV_WebSocketHandler(tornado.websocket.WebSocketHandler):
+    """Carry A/V commands and AVR state changes over a single WebSocket.
+
+    The server sends the same events as EventHandler ("avr_state",
+    "avr_patch" and "heartbeat"), and accepts the same "fields" query
+    argument. Each event is a JSON text message of the form
+    {"event": "avr_patch", "data": {...}}.
+
+    The client sends A/V commands as JSON text messages of the form
+    {"id": 17, "cmd": "avr vol+"}, where "id" is chosen by the client.
+    Each command is acknowledged by an "ack" event once it has been
+    submitted, with data {"id": 17, "ok": true, "handler": "avr vol+"},
+    or {"id": 17, "ok": false, "error": "..."} if submitting the command
+    failed.
+
+    If the command message also has an "until" key naming one of the
+    AV_Completion.Stages (e.g. {"id": 17, "cmd": "avr vol+", "until":
+    "confirmed"}), the "ack" is instead sent once the command has reached
+    that stage, with data {"id": 17, "ok": true, "stage": "confirmed"},
+    or {"id": 17, "ok": false, "error": "..."} if it failed or timed out.
+    """
+
+    Format = "ws"
+
+    def initialize(self):
+        self.fields = AVR_State.Fields  # Fields we send to the client
+
+    def prepare(self):
+        self.fields = requested_fields(self)
+
+    def open(self):
+        self.application.event_hub.add_client(self)
+
+    def on_close(self):
+        self.application.event_hub.remove_client(self)
+
+    def on_message(self, message):
+        try:
+            msg = json.loads(message)
+            req_id, cmd = msg.get("id"), msg["cmd"]
+            until = msg.get("until")
+        except (ValueError, TypeError, AttributeError, KeyError):
+            return self.ack(None, error="Malformed command message")
+        av_loop = self.application.av_loop
+        if until is None:
+            result = submit_cmd_result(av_loop, cmd)
+            return self.ack(req_id, error=result.get("error"),
+                            handler=result.get("handler"))
+        if until not in AV_Completion.Stages:
+            return self.ack(req_id, error="Unknown stage '%s'" % (until))
+
+        def done(future):
+            if self.closed():
+                return
+            try:
+                self.ack(req_id, stage=future.result())
+            except Exception as e:
+                self.ack(req_id, error="%s: %s" % (e.__class__.__name__, e))
+        av_loop.add_future(av_loop.submit(cmd, until), done)
+
+    def ack(self, req_id, error=None, **data):
+        data.update(id=req_id, ok=error is None)
+        if error is not None:
+            data["error"] = error
+        self.send(AV_EventHub.encode(self.Format, "ack", data))
+
+    def send(self, buf):
+        self.write_message(buf)
+
+    def buffered(self):
+        return stream_buffered(self.stream)
+
+    def closed(self):
+        return self.ws_connection is None or self.stream.closed()
+
+    def disconnect(self):
+        self.close()
+
+    def __str__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.request.remote_ip)
 
 
 class AV_CommandHandler(tornado.web.RequestHandler):
+    """Submit the A/V command given by the request path.
+
+    E.g. "/cmd/avr/vol+" submits "avr vol+", and returns immediately. If
+    the "until" query argument names one of the AV_Completion.Stages
+    (e.g. "/cmd/avr/vol+?until=confirmed"), the response is instead sent
+    once the command has reached that stage, as a JSON object with the
+    "cmd" and the "stage" reached, or an "error" (with status 504 if the
+    stage was not reached in time, or 500 if the command failed).
+    """
 
+    @tornado.gen.coroutine
     def get(self, path):
         # Turn self.path into an A/V command and submit it
         cmd = path.strip("/").replace("/", " ")
-        self.application.av_loop.submit_cmd(cmd)
+        until = self.get_argument("until", None)
+        if until is None:
+            self.application.av_loop.submit_cmd(cmd)
+            return
+        if until not in AV_Completion.Stages:
+            raise tornado.web.HTTPError(400, "Unknown stage '%s'" % (until))
+
+        try:
+            stage = yield self.application.av_loop.submit(cmd, until)
+        except Exception as e:
+            self.set_status(504 if isinstance(e, TimeoutError) else 500)
+            self.write({"cmd": cmd, "error": "%s: %s" % (
+                e.__class__.__name__, e)})
+            return
+        self.write({"cmd": cmd, "stage": stage})
 
     post = get
 
 
+class AV_BatchCommandHandler(tornado.web.RequestHandler):
+    """Submit an ordered list of A/V commands in a single request.
+
+    The request body is a JSON list of A/V commands, e.g. ["hdmi 2",
+    "avr on", "avr source vid1", "avr surround dolby"]. The commands are
+    submitted in order, and a failing command does not prevent the
+    following commands from being submitted. The response is a JSON
+    object whose "results" list holds one submit_cmd_result() dict per
+    command, in the same order.
+    """
+
+    def post(self):
+        try:
+            cmds = json.loads(self.request.body.decode("utf-8"))
+        except ValueError:
+            raise tornado.web.HTTPError(400, "Malformed JSON body")
+        if not isinstance(cmds, list) or not all(
+                isinstance(cmd, str) for cmd in cmds):
+            raise tornado.web.HTTPError(400, "Expected a list of commands")
+
+        av_loop = self.application.av_loop
+        self.write({"results": [
+            submit_cmd_result(av_loop, cmd) for cmd in cmds]})
+
+
+class AV_DiagnosticsHandler(tornado.web.RequestHandler):
+
+    def get(self):
+        # Report runtime statistics from all A/V devices as JSON
+        devices = self.application.av_loop.devices
+        self.write(dict(
+            (name, dev.diagnostics()) for name, dev in devices.items()))
+
+
 class AV_HTTPServer(AV_Device, tornado.web.Application):
 
     Description = "A/V controller HTTP server"
@@ -94,9 +508,14 @@ class AV_HTTPServer(AV_Device, tornado.web.Application):
     def __init__(self, av_loop, name):
         AV_Device.__init__(self, av_loop, name)
         self.docroot = av_loop.args['%s_root' % (self.name)]
+        check_stream_buffered()
+        self.event_hub = AV_EventHub(av_loop)
         tornado.web.Application.__init__(self, [
             (r"/events", EventHandler),
+            (r"/ws", AV_WebSocketHandler),
             (r"/cmd/(.*)", AV_CommandHandler),
+            (r"/batch", AV_BatchCommandHandler),
+            (r"/diag", AV_DiagnosticsHandler),
             (r"/", tornado.web.RedirectHandler,
                 {"url": "/index.html"}),
             (r"/(.*)", tornado.web.StaticFileHandler,
@@ -107,6 +526,9 @@ class AV_HTTPServer(AV_Device, tornado.web.Application):
         self.server_port = int(av_loop.args["%s_port" % (self.name)])
         self.listen(self.server_port, self.server_host)
 
+    def diagnostics(self):
+        return {"events": self.event_hub.diagnostics()}
+
 
 def main(args):
     import argparse
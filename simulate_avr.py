@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""
+Run a long AVR scenario against Fake_AVR, in simulated time.
+
+AVR_Device, Fake_AVR (connected by a local pty) and AV_CommandRepeater
+share one AV_Loop, driven by an AV_SimClock: whenever the loop would wait
+for its next timeout, simulated time jumps straight to it. An hour of
+interaction thus finishes in seconds, and given the same --seed, every
+run produces the same results.
+
+The scenario powers the AVR on, and then performs a random action every
+--interval seconds: volume steps, absolute volume changes, mute toggles
+and held volume keys. Each command is submitted until "confirmed", and
+the outcomes are summarized at the end, along with the final volume of
+the AVR as seen by AVR_Device and by Fake_AVR.
+
+    ./simulate_avr.py --duration 3600 --fake-min-gap 0.15
+
+Use --real-time to run the same scenario on the real clock.
+"""
+
+import sys
+import time
+import random
+import argparse
+from tornado.ioloop import IOLoop
+
+from av_clock import AV_Clock, AV_SimClock
+from av_loop import AV_Loop
+from avr_device import AVR_Device
+from fake_avr import Fake_AVR
+from cmd_repeater import AV_CommandRepeater
+
+
+CmdTimeout = 60.0  # Simulated seconds for each command to be confirmed
+
+
+def make_scenario(rnd, duration, interval):
+    """Return a list of (time, cmd) pairs, relative to the start."""
+    ret = [(1.0, "avr on")]
+    t = 1.0 + interval
+    while t < duration:
+        action = rnd.choice(("step", "step", "volume", "mute", "hold"))
+        if action == "step":
+            ret.append((t, rnd.choice(("avr vol+", "avr vol-"))))
+        elif action == "volume":
+            ret.append((t, "avr volume %i" % (rnd.randint(-50, -20))))
+        elif action == "mute":  # Mute, and unmute a little later
+            ret.append((t, "avr mute"))
+            ret.append((t + rnd.uniform(1, interval / 2), "avr mute"))
+        elif action == "hold":
+            cmd = rnd.choice(("avr vol+", "avr vol-"))
+            ret.append((t, "repeat start " + cmd))
+            ret.append((t + rnd.uniform(0.2, 3.0), "repeat stop " + cmd))
+        t += interval
+    return sorted(ret)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="Simulate AVR interaction against " + Fake_AVR.Description)
+    AVR_Device.register_args("avr", parser)
+    Fake_AVR.register_args("fake", parser)
+    AV_CommandRepeater.register_args("repeat", parser)
+    parser.add_argument(
+        "--duration", type=float, default=3600.0, metavar="SECS",
+        help="Length of the scenario (default: %(default)s)")
+    parser.add_argument(
+        "--interval", type=float, default=30.0, metavar="SECS",
+        help="Time between actions (default: %(default)s)")
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="Random seed for the scenario (default: %(default)s)")
+    parser.add_argument(
+        "--real-time", action="store_true",
+        help="Run on the real clock instead of simulated time")
+    parsed = parser.parse_args(args)
+
+    clock = AV_Clock() if parsed.real_time else AV_SimClock()
+    IOLoop.configure(AV_Loop, parsed_args=vars(parsed), clock=clock)
+    mainloop = IOLoop.instance()
+
+    fake = Fake_AVR(mainloop, "fake")
+    mainloop.add_device("fake", fake)
+    mainloop.args["avr_tty"] = fake.client_name()
+    avr = AVR_Device(mainloop, "avr")
+    mainloop.add_device("avr", avr)
+    mainloop.add_device("repeat", AV_CommandRepeater(mainloop, "repeat"))
+
+    outcomes = {}  # Map (command, outcome) -> count
+
+    def record(cmd, future):
+        words = cmd.split()
+        if words[1] == "volume":  # Ignore the argument
+            words = words[:2]
+        try:
+            outcome = future.result()
+        except Exception as e:
+            outcome = e.__class__.__name__
+        key = (" ".join(words), outcome)
+        outcomes[key] = outcomes.get(key, 0) + 1
+
+    def submit(cmd):
+        mainloop.add_future(
+            mainloop.submit(cmd, "confirmed", CmdTimeout),
+            lambda future: record(cmd, future))
+
+    scenario = make_scenario(
+        random.Random(parsed.seed), parsed.duration, parsed.interval)
+    for t, cmd in scenario:
+        mainloop.add_timeout(mainloop.t0 + t, lambda cmd=cmd: submit(cmd))
+    mainloop.add_timeout(mainloop.t0 + parsed.duration, mainloop.stop)
+
+    real_t0 = time.time()
+    mainloop.run()
+    real_t = time.time() - real_t0
+
+    print()
+    print("Ran %u commands in %.1f s of %s time" % (
+        len(scenario), mainloop.get_ts(),
+        "real" if parsed.real_time else "simulated"))
+    print("%-24s %-14s %6s" % ("command", "outcome", "count"))
+    for (cmd, outcome), count in sorted(outcomes.items()):
+        print("%-24s %-14s %6u" % (cmd, outcome, count))
+    print("Final state: %s" % (avr.state))
+    print("Fake AVR volume: %idB" % (fake.volume))
+    print("Writes: %s" % (avr.diagnostics()["write_queue"]))
+    print("Pacing: %s" % (avr.diagnostics()["pacing"]))
+    print("Fake AVR: %s" % (fake.diagnostics()))
+    if clock.Simulated:
+        # Only the real time, and how often in-flight pty data had to be
+        # flushed before simulated time could advance, vary between runs
+        print("Advanced simulated time %u times" % (
+            clock.stats["advances"]))
+        print("(%.1f s real time, %u pty flushes)" % (
+            real_t, clock.stats["flushed"]))
+    else:
+        print("(%.1f s real time)" % (real_t))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -2,19 +2,23 @@
 
 import sys
 import time
+import heapq
+import itertools
 
 
 class TimedQueue(object):
     """Encapsulate a queue of objects with associated timeouts.
 
-    Each element in the queue consists of a (timeout, object) pair,
-    sorted on timeout (some absolute time on the same format as
-    returned from time.time()).
+    Each element in the queue consists of a (timeout, object) pair, kept
+    in a heap ordered on timeout (some absolute time on the same format
+    as returned from the given clock, by default the io_loop's time(), or
+    time.monotonic() without an io_loop).
+    Objects with equal timeouts are kept in the order they were added.
 
     Call current() to retrieve the object that is currently valid.
-    This is the first object in the queue whose timeout has not yet
-    expired. current() will automatically remove objects whose timeout
-    has expired.
+    This is the object in the queue with the earliest timeout that has
+    not yet expired. current() will automatically remove objects whose
+    timeout has expired.
 
     Use add_absolute() and/or add_relative() to add objects with
     absolute/relative timeouts, respectively. Trying to add a timeout
@@ -22,47 +26,86 @@ class TimedQueue(object):
 
     At the "end" of the queue is a default object which will never
     expire. The default is given to the constructor, or to flush().
+
+    If an io_loop and a callback are given, callback(obj) is invoked from
+    the io_loop whenever the current object changes because a timeout
+    expired (obj is the new current object), so that there is no need to
+    poll current() to notice expiry.
     """
 
-    def __init__(self, default=None):
-        self.q = [(sys.maxsize, default)]
+    def __init__(self, default=None, io_loop=None, callback=None,
+                 clock=None):
+        self.io_loop = io_loop
+        self.callback = callback
+        if clock is None:
+            clock = time.monotonic if io_loop is None else io_loop.time
+        self.clock = clock
+        self.seq = itertools.count()  # Tie-breaker for equal timeouts
+        self.timer = None  # or (timeout_handle, timeout)
+        self.flush(default)
+
+    def __len__(self):
+        """Return the number of objects (excluding default) in the queue."""
+        return len(self.q)
+
+    def _expire(self, now):
+        """Discard all expired objects from the front of the queue."""
+        q = self.q
+        while q and q[0][0] < now:
+            heapq.heappop(q)
 
     def current(self):
         """Return the currently active/available object.
 
         Discard all expired objects from the front of the queue.
         """
-        now = time.time()
-
-        # Remove all leading entries whose timeout < nw
-        while self.q[0][0] < now:
-            assert len(self.q)
-            self.q.pop(0)
-
-        # Return the first entry
-        assert self.q[0][0] >= now
-        return self.q[0][1]
+        self._expire(self.clock())
+        return self.q[0][2] if self.q else self.default
 
     def add_absolute(self, timeout, obj):
         """Add an object with the given absolute timeout."""
-        assert timeout > time.time()
-        i = 0
-        # Find appropriate place in self.q for the given obj
-        while self.q[i][0] <= timeout:
-            i += 1
-        self.q.insert(i, (timeout, obj))
+        assert timeout > self.clock()
+        heapq.heappush(self.q, (timeout, next(self.seq), obj))
+        self._schedule()
 
     def add_relative(self, rel_timeout, obj):
         """Add an object with a timeout relative to now."""
-        return self.add_absolute(time.time() + rel_timeout, obj)
+        return self.add_absolute(self.clock() + rel_timeout, obj)
 
     def flush(self, default=None):
         """Empty the queue, and restart with a new default."""
-        self.q = [(sys.maxsize, default)]
+        self.q = []  # Heap of (timeout, seq, obj) tuples
+        self.default = default
+        self._schedule()
+
+    def _schedule(self):
+        """Set up (or cancel) the io_loop timer for the next expiry."""
+        if self.io_loop is None or self.callback is None:
+            return
+        timeout = self.q[0][0] if self.q else None
+        if self.timer is not None:
+            if self.timer[1] == timeout:
+                return  # Already scheduled
+            self.io_loop.remove_timeout(self.timer[0])
+            self.timer = None
+        if timeout is not None:
+            self.timer = (self.io_loop.call_later(
+                max(0, timeout - self.clock()), self._expired), timeout)
+
+    def _expired(self):
+        timeout = self.timer[1]
+        self.timer = None
+        # The io_loop may run us slightly early; expire what we were due
+        q = self.q
+        while q and q[0][0] <= timeout:
+            heapq.heappop(q)
+        obj = self.current()
+        self._schedule()
+        self.callback(obj)
 
 
 def main(args):
-    now = time.time()
+    now = time.monotonic()
 
     q = TimedQueue("forever")
     q.add_relative(0.01, "immediate")
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+
+class AV_WritePacer(object):
+    """Decide when the next write to a device may happen, from its feedback.
+
+    After each write, the device is expected to report a status change
+    within the current timeout. When it does, the next write is allowed
+    after the current settle time. When it does not, the write is assumed
+    to be lost (the device was not ready for it), and the next write is
+    allowed straight away, but both the settle time and the timeout are
+    backed off.
+
+    The timeout tracks the measured write->status latency (a moving
+    average, with some margin), and the settle time is decreased a little
+    after every confirmed write. With adapt=False, the pacer keeps its
+    initial timeout and settle time.
+    """
+
+    Margin = 2.0  # Timeout, relative to the average write->status latency
+    Decrease = 0.95  # Settle time factor after each confirmed write
+    Backoff = 2.0  # Settle time and timeout factor after each lost write
+    Smoothing = 0.2  # Weight of each new latency sample in the average
+
+    def __init__(self, timeout=1.0, settle=0.25, min_timeout=0.1,
+                 max_timeout=2.0, min_settle=0.02, max_settle=1.0,
+                 adapt=True):
+        self.timeout = timeout
+        self.settle = settle
+        self.min_timeout, self.max_timeout = min_timeout, max_timeout
+        self.min_settle, self.max_settle = min_settle, max_settle
+        self.adapt = adapt
+
+        self.written_at = None  # Time of last unconfirmed write
+        self.latency = None  # Moving average of write->status latency
+        self.stats = {"writes": 0, "confirmed": 0, "lost": 0}
+
+    def awaiting(self):
+        """Return True iff the last write has not been confirmed."""
+        return self.written_at is not None
+
+    def wrote(self, now):
+        """Record a write, and return the deadline for its confirmation."""
+        self.stats["writes"] += 1
+        self.written_at = now
+        return now + self.timeout
+
+    def feedback(self, now):
+        """Record a status change, and return when to allow next write."""
+        if self.written_at is not None:
+            self.stats["confirmed"] += 1
+            latency, self.written_at = now - self.written_at, None
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.Smoothing * (latency - self.latency)
+            if self.adapt:
+                self.timeout = min(self.max_timeout, max(
+                    self.min_timeout, self.latency * self.Margin))
+                self.settle = max(
+                    self.min_settle, self.settle * self.Decrease)
+        return now + self.settle
+
+    def expired(self):
+        """Record that the last write was not confirmed in time."""
+        if self.written_at is None:
+            return
+        self.stats["lost"] += 1
+        self.written_at = None
+        if self.adapt:
+            self.settle = min(self.max_settle, self.settle * self.Backoff)
+            self.timeout = min(self.max_timeout, self.timeout * self.Backoff)
+
+    def diagnostics(self):
+        ret = dict(self.stats)
+        ret.update(timeout=self.timeout, settle=self.settle,
+                   latency=self.latency)
+        return ret
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+import time
+from collections import deque
+
+
+class QueueFullError(Exception):
+    """A write was dropped because the write queue was full."""
+    pass
+
+
+class AV_Write(object):
+    """A pending write to an A/V device."""
+
+    __slots__ = ("data", "completions", "coalesce", "priority", "queued_at")
+
+    def __init__(self, data, queued_at, completion=None, coalesce=True,
+                 priority="normal"):
+        self.data = data
+        self.queued_at = queued_at  # From the AV_WriteQueue's clock
+        self.completions = [] if completion is None else [completion]
+        self.coalesce = coalesce  # False to exempt from coalescing
+        self.priority = priority
+
+    def __str__(self):
+        return " ".join(["%02x" % (b) for b in self.data])
+
+
+class AV_WriteQueue(object):
+    """Queue writes to an A/V device, keeping only their net effect.
+
+    Newly pushed writes are coalesced with pending (not yet written) ones
+    according to the following rules, all given as sets/maps of data:
+     - supersedes: Maps data to a group of writes that override each
+       other (e.g. selecting different sources). Pending writes in the
+       same group as a new write are dropped.
+     - idempotent: Writes that have no additional effect when repeated
+       (e.g. POWER ON). A new write identical to a pending one is dropped.
+     - opposites: Maps data to the data that undoes its effect (e.g. VOL
+       UP and VOL DOWN). A new write cancels out (i.e. removes) the most
+       recent pending opposite write, and is itself dropped.
+
+    Writes pushed with coalesce=False are never coalesced with others.
+
+    Completions (see AV_Completion) attached to dropped writes are either
+    attached to the identical pending write, or notified via skipped().
+
+    Each write belongs to one of the Priorities classes, and pop() always
+    returns the oldest write of the most urgent class. If max_depth is
+    given, at most that many writes are kept pending. When a write is
+    pushed onto a full queue, the drop_policy decides what is dropped:
+     - "oldest": Drop the oldest write of the least urgent class that is
+       not more urgent than the new write. If there is no such write,
+       drop the new write.
+     - "newest": Drop the new write.
+    The completions of writes dropped this way fail with QueueFullError.
+    """
+
+    Priorities = ("urgent", "normal", "bulk")
+
+    DropPolicies = ("oldest", "newest")
+
+    def __init__(self, opposites=None, idempotent=(), supersedes=None,
+                 max_depth=None, drop_policy="oldest", clock=time.time):
+        assert drop_policy in self.DropPolicies
+        self.opposites = opposites or {}
+        self.idempotent = frozenset(idempotent)
+        self.supersedes = supersedes or {}
+        self.max_depth = max_depth
+        self.drop_policy = drop_policy
+        self.clock = clock  # For measuring queueing delays
+
+        # Map priority class to deque of AV_Write objects, in write order
+        self.pending = dict((p, deque()) for p in self.Priorities)
+        self.stats = {"pushed": 0, "written": 0,
+                      "cancelled": 0, "collapsed": 0, "superseded": 0,
+                      "dropped": 0, "discarded": 0, "max_depth": 0,
+                      "wait_total": 0.0, "wait_max": 0.0}
+
+    def __len__(self):
+        return sum(len(q) for q in self.pending.values())
+
+    def depths(self):
+        """Return the number of pending writes in each priority class."""
+        return dict((p, len(q)) for p, q in self.pending.items())
+
+    def diagnostics(self):
+        ret = dict(self.stats)
+        ret["depth"] = self.depths()
+        written = ret["written"]
+        ret["wait_mean"] = written and ret["wait_total"] / written or 0.0
+        return ret
+
+    def _find(self, match):
+        """Return (queue, index) of the last coalescable write matching
+        match(), or (None, -1) if there is none."""
+        for q in self.pending.values():
+            for i in range(len(q) - 1, -1, -1):
+                w = q[i]
+                if w.coalesce and match(w.data):
+                    return q, i
+        return None, -1
+
+    def _drop(self, q, i):
+        """Remove the given pending write, and return completions to
+        confirm."""
+        ret = []
+        w = q[i]
+        del q[i]
+        for completion in w.completions:
+            if completion.skipped():
+                ret.append(completion)
+        return ret
+
+    def _make_room(self, priority):
+        """Drop a write to make room for a new write of the given priority.
+
+        Return False if the new write should be dropped instead.
+        """
+        if self.drop_policy == "newest":
+            return False
+        for p in reversed(self.Priorities):
+            q = self.pending[p]
+            if q:
+                self.stats["dropped"] += 1
+                for completion in q.popleft().completions:
+                    completion.fail(QueueFullError(
+                        "Write dropped from full %s queue" % (p)))
+                return True
+            if p == priority:
+                return False
+        return False
+
+    def push(self, data, completion=None, coalesce=True, priority="normal"):
+        """Add a write of the given data and priority to the queue.
+
+        The write is coalesced with pending writes as described above.
+        Return the list of completions that were fully written as a
+        result of coalescing, and now await confirmation from the device.
+        """
+        self.stats["pushed"] += 1
+        if completion is not None:
+            completion.add_write()
+
+        ret = []
+        if coalesce:
+            needed, ret = self._coalesce(data, completion)
+            if not needed:  # Coalesced into other writes
+                return ret
+
+        if self.max_depth is not None and len(self) >= self.max_depth \
+                and not self._make_room(priority):
+            self.stats["dropped"] += 1
+            if completion is not None:
+                completion.fail(QueueFullError(
+                    "Write dropped from full %s queue" % (priority)))
+            return ret
+
+        self.pending[priority].append(
+            AV_Write(data, self.clock(), completion, coalesce, priority))
+        self.stats["max_depth"] = max(self.stats["max_depth"], len(self))
+        return ret
+
+    def _coalesce(self, data, completion):
+        """Coalesce a new write of the given data with pending writes.
+
+        Return a (needed, completions) tuple, where needed is False if
+        the new write is no longer needed, and completions is the list of
+        completions to confirm (see push()).
+        """
+        ret = []
+        group = self.supersedes.get(data)
+        if group is not None:
+            while True:
+                q, i = self._find(lambda d: d != data and
+                                  self.supersedes.get(d) == group)
+                if q is None:
+                    break
+                self.stats["superseded"] += 1
+                ret.extend(self._drop(q, i))
+
+        if data in self.idempotent:
+            q, i = self._find(lambda d: d == data)
+            if q is not None:
+                self.stats["collapsed"] += 1
+                if completion is not None:
+                    q[i].completions.append(completion)
+                return False, ret
+
+        opposite = self.opposites.get(data)
+        if opposite is not None:
+            q, i = self._find(lambda d: d == opposite)
+            if q is not None:
+                self.stats["cancelled"] += 2
+                ret.extend(self._drop(q, i))
+                if completion is not None and completion.skipped():
+                    ret.append(completion)
+                return False, ret
+        return True, ret
+
+    def discard(self, completion):
+        """Remove the pending writes attached to the given completion.
+
+        Writes that are shared with other completions (by coalescing)
+        are kept, but no longer count towards the given completion.
+        Return the list of completions to confirm (see push()).
+        """
+        ret = []
+        for q in self.pending.values():
+            for i in range(len(q) - 1, -1, -1):
+                w = q[i]
+                if completion not in w.completions:
+                    continue
+                self.stats["discarded"] += 1
+                if len(w.completions) > 1:
+                    w.completions.remove(completion)
+                    if completion.skipped():
+                        ret.append(completion)
+                else:
+                    ret.extend(self._drop(q, i))
+        return ret
+
+    def pop(self):
+        """Remove and return the next AV_Write to be written."""
+        for p in self.Priorities:
+            q = self.pending[p]
+            if q:
+                w = q.popleft()
+                wait = self.clock() - w.queued_at
+                self.stats["written"] += 1
+                self.stats["wait_total"] += wait
+                self.stats["wait_max"] = max(self.stats["wait_max"], wait)
+                return w
+        raise IndexError("pop from empty write queue")
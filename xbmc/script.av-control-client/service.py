@@ -0,0 +1,182 @@
+"""
+XBMC service for forwarding XBMC events to a A/V control server
+
+Unlike default.py (which is started in a new Python interpreter, and opens
+a new HTTP connection for every event), this service is started once when
+XBMC starts, and keeps a persistent HTTP connection to the A/V control
+server. Events are delivered to the service with NotifyAll() from the
+keymap, e.g.:
+
+  NotifyAll(script.av-control-client, avr vol+)
+
+Events are queued, and all events that have queued up while waiting for
+the server are forwarded together in a single POST to /batch. If the
+persistent connection cannot be (re-)established, each event is instead
+forwarded in its own /cmd/ request, like default.py does. Since a batch
+is not idempotent, it is never resent (nor forwarded through /cmd/) once
+the server may have received it.
+
+Author: Johan Herland
+"""
+
+import httplib
+import json
+import select
+import threading
+import urllib
+import Queue
+
+import xbmc
+
+av_host = "phi:8000"
+av_server = "http://%s/cmd/" % (av_host)
+
+AddonId = "script.av-control-client"
+Timeout = 2.0  # seconds
+
+
+def log(msg):
+    xbmc.log("%s: %s" % (AddonId, msg), xbmc.LOGDEBUG)
+
+
+def send_fallback(av_cmd):
+    """Forward the given A/V command exactly like default.py does."""
+    url = av_server + urllib.quote("/".join(av_cmd.split()))
+    urllib.urlopen(url).read()
+
+
+class AV_NotDelivered(Exception):
+    """The /batch request was not delivered to (or not run by) the server.
+
+    The commands in the batch can therefore safely be sent again.
+    """
+    pass
+
+
+class AV_Connection(object):
+    """Persistent HTTP connection to the A/V control server."""
+
+    def __init__(self, host):
+        self.host = host
+        self.conn = None
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _post_batch(self, av_cmds):
+        """POST the given A/V commands to /batch, and return the results.
+
+        Raise AV_NotDelivered if the request could not be sent in full
+        (the server does not act on a partial request), or if the server
+        does not support /batch. Any other failure happens after the
+        server may have received, and run, the commands.
+        """
+        if self.conn is not None and self.conn.sock is not None:
+            # An idle connection should have nothing to read. If it does,
+            # the server has closed it (or is misbehaving), so don't use it
+            if select.select([self.conn.sock], [], [], 0)[0]:
+                self.close()
+        if self.conn is None:
+            self.conn = httplib.HTTPConnection(self.host, timeout=Timeout)
+        try:
+            self.conn.request("POST", "/batch", json.dumps(av_cmds),
+                              {"Content-Type": "application/json"})
+        except (httplib.HTTPException, IOError) as e:
+            self.close()
+            raise AV_NotDelivered(e)
+        response = self.conn.getresponse()
+        body = response.read()  # Must drain response to reuse connection
+        if response.status in (404, 405):  # Older server without /batch
+            raise AV_NotDelivered("HTTP status %u" % (response.status))
+        if response.status != 200:
+            raise httplib.HTTPException(
+                "HTTP status %u: %s" % (response.status, body))
+        return json.loads(body)["results"]
+
+    def send_batch(self, av_cmds):
+        """Forward the given A/V commands in a single request.
+
+        If sending the request on a reused connection fails, it is sent
+        once more on a new connection, as the server may have closed the
+        idle connection since the last request. Requests that fail after
+        being sent are never resent, as the commands may already have
+        been run.
+        """
+        reused = self.conn is not None
+        try:
+            return self._post_batch(av_cmds)
+        except AV_NotDelivered:
+            if not reused or self.conn is not None:  # Not a send failure
+                raise
+        return self._post_batch(av_cmds)
+
+
+class AV_Monitor(xbmc.Monitor):
+    """Queue A/V commands received from NotifyAll(AddonId, ...)."""
+
+    def __init__(self, queue):
+        xbmc.Monitor.__init__(self)
+        self.queue = queue
+
+    def onNotification(self, sender, method, data):
+        if sender != AddonId:
+            return
+        # NotifyAll(sender, message) is delivered as method "Other.message"
+        av_cmd = method.split(".", 1)[-1].strip()
+        if av_cmd:
+            self.queue.put(av_cmd)
+
+
+def forward_cmds(queue):
+    """Forward queued A/V commands until None is dequeued."""
+    conn = AV_Connection(av_host)
+    while True:
+        av_cmds = [queue.get()]
+        try:  # Pick up anything else that was queued in the meantime
+            while True:
+                av_cmds.append(queue.get_nowait())
+        except Queue.Empty:
+            pass
+        stop = None in av_cmds
+        av_cmds = [c for c in av_cmds if c is not None]
+
+        if av_cmds:
+            try:
+                for result in conn.send_batch(av_cmds):
+                    if not result["accepted"]:
+                        log("%s failed: %s" % (result["cmd"], result["error"]))
+            except AV_NotDelivered as e:
+                log("Batch request failed (%s), falling back to /cmd/" % (e))
+                conn.close()
+                for av_cmd in av_cmds:
+                    try:
+                        send_fallback(av_cmd)
+                    except IOError as e:
+                        log("Failed to forward %s: %s" % (av_cmd, e))
+            except (httplib.HTTPException, IOError, ValueError, KeyError) as e:
+                # The server may have run the commands, so don't resend
+                log("Batch request failed (%s), dropping %s" % (e, av_cmds))
+                conn.close()
+        if stop:
+            conn.close()
+            return
+
+
+def main():
+    queue = Queue.Queue()
+    monitor = AV_Monitor(queue)
+    forwarder = threading.Thread(target=forward_cmds, args=(queue,))
+    forwarder.start()
+
+    while not monitor.abortRequested():
+        if monitor.waitForAbort(10):
+            break
+
+    queue.put(None)
+    forwarder.join()
+
+
+if __name__ == "__main__":
+    main()